@@ -0,0 +1,98 @@
+import sys
+from array import array
+
+PAINTED = 0xff000000
+RGB_MASK = 0x00ffffff
+CHUNK_SIZE = 32
+
+
+def to_wire(pixels):
+    if sys.byteorder == 'big':
+        pixels = array('I', pixels)
+        pixels.byteswap()
+    return memoryview(pixels).cast('B')
+
+
+def from_wire(data):
+    pixels = array('I')
+    pixels.frombytes(data)
+    if sys.byteorder == 'big':
+        pixels.byteswap()
+    return pixels
+
+
+class Canvas:
+    def __init__(self, width, height):
+        self.width: int = width
+        self.height: int = height
+        self.pixels = array('I', [0]) * (width * height)
+
+    @classmethod
+    def from_bytes(cls, width, height, data):
+        canvas = cls(width, height)
+        canvas.pixels[:] = from_wire(data)
+        return canvas
+
+    def copy(self):
+        canvas = Canvas(self.width, self.height)
+        canvas.pixels[:] = self.pixels
+        return canvas
+
+    def contains(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get(self, x, y):
+        value = self.pixels[y * self.width + x]
+        return value & RGB_MASK if value else None
+
+    def set(self, x, y, rgb):
+        self.pixels[y * self.width + x] = PAINTED | rgb
+
+    def is_painted(self, x, y):
+        return self.pixels[y * self.width + x] != 0
+
+    def painted(self):
+        width = self.width
+        for index, value in enumerate(self.pixels):
+            if value:
+                yield index % width, index // width, value & RGB_MASK
+
+    def clear(self):
+        self.pixels[:] = array('I', [0]) * len(self.pixels)
+
+    def snapshot(self):
+        return to_wire(self.pixels)
+
+    def chunk_of(self, x, y):
+        return x // CHUNK_SIZE, y // CHUNK_SIZE
+
+    def chunks_in(self, x, y, width, height):
+        left = max(x, 0) // CHUNK_SIZE
+        top = max(y, 0) // CHUNK_SIZE
+        right = (min(x + width, self.width) - 1) // CHUNK_SIZE
+        bottom = (min(y + height, self.height) - 1) // CHUNK_SIZE
+        return {(cx, cy)
+                for cx in range(left, right + 1)
+                for cy in range(top, bottom + 1)}
+
+    def chunk_rect(self, cx, cy):
+        x = cx * CHUNK_SIZE
+        y = cy * CHUNK_SIZE
+        return x, y, min(CHUNK_SIZE, self.width - x), min(CHUNK_SIZE, self.height - y)
+
+    def region(self, x, y, width, height):
+        pixels = array('I')
+        for row in range(y, y + height):
+            start = row * self.width + x
+            pixels.extend(self.pixels[start:start + width])
+        return to_wire(pixels)
+
+    def paste(self, x, y, width, height, data):
+        pixels = from_wire(data)
+        for row in range(height):
+            start = (y + row) * self.width + x
+            self.pixels[start:start + width] = pixels[row * width:(row + 1) * width]
+
+    def chunk(self, cx, cy):
+        x, y, width, height = self.chunk_rect(cx, cy)
+        return x, y, width, height, self.region(x, y, width, height)
@@ -1,113 +1,99 @@
-import socket
-import pickle
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import math
 import threading
 import os
 
-from PyQt6.QtCore import pyqtSignal, QObject, pyqtSlot, QRect, Qt
+from PyQt6.QtCore import pyqtSignal, QObject, pyqtSlot, QPoint, QRect, Qt, QTimer
 from PyQt6.QtWidgets import (QApplication, QMainWindow,
-                             QColorDialog, QPushButton,
+                             QColorDialog, QSizePolicy,
                              QWidget, QLabel, QVBoxLayout)
 from PyQt6.QtGui import QImage, QPainter, QPixmap
-from queue import Queue
+
+import export
+import game_client
+import protocol
+from canvas import Canvas, PAINTED
 from registration import Ui_Registration
 from choose_room_window import Ui_RoomWindow
 from choose_color_window import Ui_ChooseColorWindow
 from game_room import Ui_GameWindow
 
+COUNTDOWN_INTERVAL = 250
+REPLAY_SPEED = 10.0
+
+class StartupTimer:
+    def __init__(self, started):
+        self.started = started
+        self.marks = {}
+
+    def mark(self, name, label):
+        if name in self.marks:
+            return
+        self.marks[name] = time.perf_counter() - self.started
+        print(f'{label}: {self.marks[name] * 1000:.0f} мс')
+
+    def mark_later(self, name, label):
+        QTimer.singleShot(0, lambda: self.mark(name, label))
+
+startup = StartupTimer(STARTED)
+
 class Communication(QObject):
     free_rooms_updater = pyqtSignal(list)
     chat_updater = pyqtSignal(str)
     color_free = pyqtSignal()
     color_not_free = pyqtSignal(str)
-    game_updater = pyqtSignal(str)
+    game_updater = pyqtSignal(list)
     start_game = pyqtSignal(str)
     end_game = pyqtSignal()
-    continue_game = pyqtSignal(dict)
+    continue_game = pyqtSignal(object)
+    resume_game = pyqtSignal()
+    room_info = pyqtSignal(dict)
+    room_not_free = pyqtSignal(dict)
+    chunk_updater = pyqtSignal(int, int, int, int, bytes)
     exit_app = pyqtSignal()
     update_timer = pyqtSignal(int)
+    game_timer = pyqtSignal(float)
+    pixel_rejected = pyqtSignal(int)
+    replay_start = pyqtSignal(dict)
+    replay_moves = pyqtSignal(list)
+    replay_end = pyqtSignal()
     exit_color_window = pyqtSignal()
-
-class GameClient:
-    def __init__(self, host, port, communication):
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.connect((host, port))
-        self.isConnected = True
-        self.queue = Queue()
-        self.comm = communication
-
-        threading.Thread(target=self.receive_messages, daemon=True).start()
-        threading.Thread(target=self.send_msg, daemon=True).start()
-
-    def send_msg(self):
-        while self.isConnected:
-            try:
-                msg = self.queue.get(block=True)
-                self.socket.send(msg)
-            except (ConnectionError, OSError):
-                print("Вы были отключены от сервера.")
-                self.isConnected = False
-                self.socket.close()
-                break
-
-    def send_message(self, packet):
-        self.queue.put(pickle.dumps(packet), block=False)
-
-    def receive_messages(self):
-        while self.isConnected:
-            try:
-                data_in_bytes = self.socket.recv(1024)
-
-                if not data_in_bytes:
-                    break
-
-                data = pickle.loads(data_in_bytes)
-                print(data)
-
-                match data['msgtype']:
-                    case 'free_rooms':
-                        self.comm.free_rooms_updater.emit(data['data'])
-
-                    case 'chat':
-                        self.comm.chat_updater.emit(data['data'])
-
-                    case 'start_game':
-                        self.comm.start_game.emit(data['data'])
-
-                    case 'continue_game':
-                        self.comm.continue_game.emit(data['data'])
-
-                    case 'end_game':
-                        self.comm.end_game.emit()
-
-                    case 'color_free':
-                        self.comm.color_free.emit()
-
-                    case 'color_not_free':
-                        self.comm.color_not_free.emit(data['data'])
-
-                    case 'game':
-                        self.comm.game_updater.emit(data['data'])
-
-                    case 'exit_app':
-                        self.comm.exit_app.emit()
-
-                    case 'update_timer':
-                        self.comm.update_timer.emit(data['data'])
-
-                    case 'exit_color_window':
-                        self.comm.exit_color_window.emit()
-
-            except (ConnectionError, OSError):
-                print("Вы были отключены от сервера.")
-                self.isConnected = False
-                self.socket.close()
-                break
+    connecting = pyqtSignal(int, float, str)
+    connected = pyqtSignal()
+
+def connect_signals(client, comm):
+    client.on('free_rooms', comm.free_rooms_updater.emit)
+    client.on('chat', comm.chat_updater.emit)
+    client.on('start_game', comm.start_game.emit)
+    client.on('continue_game', comm.continue_game.emit)
+    client.on('resume_game', lambda version: comm.resume_game.emit())
+    client.on('room_info', comm.room_info.emit)
+    client.on('room_not_free', comm.room_not_free.emit)
+    client.on('chunk', lambda chunk: comm.chunk_updater.emit(*chunk))
+    client.on('end_game', lambda data: comm.end_game.emit())
+    client.on('color_free', lambda data: comm.color_free.emit())
+    client.on('color_not_free', comm.color_not_free.emit)
+    client.on(game_client.PIXELS, comm.game_updater.emit)
+    client.on('exit_app', lambda data: comm.exit_app.emit())
+    client.on('update_timer', comm.update_timer.emit)
+    client.on('game_timer', lambda timer: comm.game_timer.emit(timer['remaining']))
+    client.on('nack', lambda nack: comm.pixel_rejected.emit(nack[2]))
+    client.on('exit_color_window', lambda data: comm.exit_color_window.emit())
+    client.on('replay_start', comm.replay_start.emit)
+    client.on('replay', lambda moves: comm.replay_moves.emit([(x, y, rgb)
+                                                              for _, x, y, rgb in moves]))
+    client.on('replay_end', lambda data: comm.replay_end.emit())
 
 class Registration(QMainWindow, Ui_Registration):
-    def __init__(self):
+    def __init__(self, verbose=False):
         super().__init__()
         self.comm = Communication()
-        self.client = GameClient('127.0.0.1', 3435, self.comm)
+        self.client = game_client.GameClient(verbose=verbose, connect=False)
+        connect_signals(self.client, self.comm)
         self.name: str = ''
         self.room: Room | None = None
         self.setupUi(self)
@@ -116,8 +102,37 @@ class Registration(QMainWindow, Ui_Registration):
         self.setWindowTitle("Регистрация игрока")
 
         self.send_name_button.clicked.connect(self.send)
+        self.send_name_button.setEnabled(False)
         self.comm.free_rooms_updater.connect(self.get_rooms)
+        self.comm.connecting.connect(self.retry_connect)
+        self.comm.connected.connect(self.server_connected)
         self.show()
+        startup.mark_later('first_window', 'Время до первого окна')
+
+        self.statusbar.showMessage('Подключение к серверу...')
+        threading.Thread(target=self.connect_to_server, daemon=True).start()
+
+    def connect_to_server(self):
+        def retry(attempt, delay, error):
+            self.comm.connecting.emit(attempt, delay, str(error))
+
+        if self.client.connect_with_retry(retry):
+            self.comm.connected.emit()
+
+    @pyqtSlot(int, float, str)
+    def retry_connect(self, attempt, delay, error):
+        self.statusbar.showMessage(f'Сервер недоступен ({error}). '
+                                   f'Попытка {attempt + 1} через {delay:.1f} с...')
+
+    @pyqtSlot()
+    def server_connected(self):
+        startup.mark('connected', 'Время до подключения')
+        self.statusbar.showMessage('Подключено', 2000)
+        self.send_name_button.setEnabled(True)
+
+    def closeEvent(self, event):
+        if not self.name:
+            self.client.close()
 
     def send(self):
         name = self.reg_input.text()
@@ -129,7 +144,12 @@ class Registration(QMainWindow, Ui_Registration):
 
     @pyqtSlot(list)
     def get_rooms(self, rooms):
-        self.room = Room(self, self.name, self.comm, self.client, rooms)
+        if self.room is None:
+            self.room = Room(self, self.name, self.comm, self.client, rooms)
+        else:
+            self.room.list_of_rooms.clear()
+            self.room.list_of_rooms.addItems(rooms)
+            self.room.show()
 
 class Room(QMainWindow, Ui_RoomWindow):
     def __init__(self, reg_window, name, comm, client, rooms):
@@ -142,21 +162,43 @@ class Room(QMainWindow, Ui_RoomWindow):
         self.color: Color | None = None
         self.setupUi(self)
         self.setWindowTitle(name)
+        self.list_of_rooms.setEditable(True)
         self.list_of_rooms.addItems(rooms)
         self.room: str = ''
         self.show()
 
         self.button_send.clicked.connect(self.room_is_selected)
+        self.comm.room_info.connect(self.room_joined)
+        self.comm.room_not_free.connect(self.room_rejected)
 
     def room_is_selected(self):
-        self.room = self.list_of_rooms.currentText()
+        self.room = self.list_of_rooms.currentText().strip()
+        if not self.room:
+            return
         self.client.send_message(dict(data=self.room,
                                       msgtype='room'))
+        self.button_send.setEnabled(False)
+
+    @pyqtSlot(dict)
+    def room_joined(self, board):
+        self.button_send.setEnabled(True)
         self.hide()
-        self.color = Color(self.reg_window, self, self.comm, self.client, self.name, self.room)
+        if self.color is None:
+            self.color = Color(self.reg_window, self, self.comm, self.client, self.name,
+                               self.room, board)
+        else:
+            self.color.reset(self.room, board)
+
+    @pyqtSlot(dict)
+    def room_rejected(self, reply):
+        self.button_send.setEnabled(True)
+        self.choose_room_text.clear()
+        self.choose_room_text.append(reply['message'])
+        self.list_of_rooms.clear()
+        self.list_of_rooms.addItems(reply['rooms'])
 
 class Color(QMainWindow, Ui_ChooseColorWindow):
-    def __init__(self, reg_window, choose_room_window, comm, client, name, room):
+    def __init__(self, reg_window, choose_room_window, comm, client, name, room, board):
         super().__init__()
         self.reg_window = reg_window
         self.choose_room_window = choose_room_window
@@ -166,6 +208,7 @@ class Color(QMainWindow, Ui_ChooseColorWindow):
         self.selected_color = ''
         self.game: GameWindow | None = None
         self.room = room
+        self.board = board
         self.setupUi(self)
 
         self.setWindowTitle("Выбор цвета")
@@ -180,13 +223,27 @@ class Color(QMainWindow, Ui_ChooseColorWindow):
 
         self.show()
 
+    def reset(self, room, board):
+        self.room = room
+        self.board = board
+        self.selected_color = ''
+        self.choose_room_text.clear()
+        self.label.setStyleSheet('')
+        self.button_send.setEnabled(False)
+        self.show()
+
     def join_game(self):
-        self.game = GameWindow(self.choose_room_window,
-                               self.comm,
-                               self.client,
-                               self.name,
-                               self.room,
-                               self.selected_color)
+        if self.game is None:
+            self.game = GameWindow(self.choose_room_window,
+                                   self.comm,
+                                   self.client,
+                                   self.name,
+                                   self.room,
+                                   self.selected_color,
+                                   self.board)
+        else:
+            self.game.reset(self.room, self.selected_color, self.board)
+        startup.mark_later('game_ready', 'Время до готовности к игре')
         self.client.send_message(dict(data='',
                                       msgtype='new_player'))
         self.hide()
@@ -218,24 +275,150 @@ class Color(QMainWindow, Ui_ChooseColorWindow):
         self.client.send_message(dict(data='',
                                       msgtype='exit_color_window'))
 
+class CanvasWidget(QWidget):
+    cell_clicked = pyqtSignal(int, int)
+    viewport_changed = pyqtSignal(int, int, int, int)
+
+    def __init__(self, canvas):
+        super().__init__()
+        self.cell_size = 25
+        self.offset = QPoint(0, 0)
+        self.drag_origin: QPoint | None = None
+        self.active = False
+        self.fitted = False
+        self.chunks = None
+        self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
+        self.set_canvas(canvas)
+
+    def set_canvas(self, canvas):
+        self.canvas = canvas
+        self.image = QImage(canvas.width, canvas.height, QImage.Format.Format_ARGB32)
+        self.refresh(0, 0, canvas.width, canvas.height)
+
+    def set_active(self, active):
+        self.active = active
+
+    def refresh(self, x, y, width, height):
+        pixels = bytes(self.canvas.region(x, y, width, height))
+        patch = QImage(pixels, width, height, width * 4, QImage.Format.Format_ARGB32)
+        painter = QPainter(self.image)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        painter.drawImage(x, y, patch)
+        painter.end()
+        self.update(self.cell_rect(x, y, width, height))
+
+    def set_pixels(self, pixels):
+        for x, y, rgb in pixels:
+            self.image.setPixel(x, y, PAINTED | rgb)
+        xs = [x for x, _, _ in pixels]
+        ys = [y for _, y, _ in pixels]
+        left = min(xs)
+        top = min(ys)
+        self.update(self.cell_rect(left, top, max(xs) - left + 1, max(ys) - top + 1))
+
+    def cell_rect(self, x, y, width, height):
+        size = self.cell_size
+        return QRect(self.offset.x() + x * size, self.offset.y() + y * size,
+                     width * size, height * size)
+
+    def cell_at(self, pos):
+        x = (pos.x() - self.offset.x()) // self.cell_size
+        y = (pos.y() - self.offset.y()) // self.cell_size
+        if self.canvas.contains(x, y):
+            return x, y
+        return None
+
+    def visible_cells(self, rect):
+        size = self.cell_size
+        left = max((rect.left() - self.offset.x()) // size, 0)
+        top = max((rect.top() - self.offset.y()) // size, 0)
+        right = min((rect.right() - self.offset.x()) // size + 1, self.canvas.width)
+        bottom = min((rect.bottom() - self.offset.y()) // size + 1, self.canvas.height)
+        return left, top, right - left, bottom - top
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        exposed = event.rect()
+        painter.fillRect(exposed, Qt.GlobalColor.white)
+        x, y, width, height = self.visible_cells(exposed)
+        if width <= 0 or height <= 0:
+            return
+        target = self.cell_rect(x, y, width, height)
+        painter.drawImage(target, self.image, QRect(x, y, width, height))
+        if self.cell_size >= 8:
+            painter.setPen(Qt.GlobalColor.black)
+            for column in range(x, x + width + 1):
+                left = self.offset.x() + column * self.cell_size
+                painter.drawLine(left, target.top(), left, target.bottom())
+            for row in range(y, y + height + 1):
+                top = self.offset.y() + row * self.cell_size
+                painter.drawLine(target.left(), top, target.right(), top)
+
+    def resizeEvent(self, event):
+        if not self.fitted:
+            self.fit()
+        self.emit_viewport()
+
+    def fit(self):
+        self.fitted = True
+        self.offset = QPoint(0, 0)
+        self.cell_size = max(1, min(25,
+                                    self.width() // self.canvas.width,
+                                    self.height() // self.canvas.height))
+        self.update()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            cell = self.cell_at(event.position().toPoint())
+            if self.active and cell and not self.canvas.is_painted(*cell):
+                self.cell_clicked.emit(*cell)
+        else:
+            self.drag_origin = event.position().toPoint()
+
+    def mouseMoveEvent(self, event):
+        if self.drag_origin is None:
+            return
+        pos = event.position().toPoint()
+        self.offset += pos - self.drag_origin
+        self.drag_origin = pos
+        self.update()
+        self.emit_viewport()
+
+    def mouseReleaseEvent(self, event):
+        self.drag_origin = None
+
+    def wheelEvent(self, event):
+        old_size = self.cell_size
+        if event.angleDelta().y() > 0:
+            self.cell_size = min(old_size * 2, 64)
+        else:
+            self.cell_size = max(old_size // 2, 1)
+        if self.cell_size == old_size:
+            return
+        pos = event.position().toPoint()
+        self.offset = pos - (pos - self.offset) * self.cell_size / old_size
+        self.update()
+        self.emit_viewport()
+
+    def emit_viewport(self):
+        viewport = self.visible_cells(self.rect())
+        chunks = self.canvas.chunks_in(*viewport)
+        if chunks != self.chunks:
+            self.chunks = chunks
+            self.viewport_changed.emit(*viewport)
+
 class GameWindow(QMainWindow, Ui_GameWindow):
-    def __init__(self, choose_room_window, comm, client, name, room, color):
+    def __init__(self, choose_room_window, comm, client, name, room, color, board):
         super().__init__()
         self.choose_room_window = choose_room_window
         self.comm = comm
         self.client = client
         self.name = name
-        self.room = room
-        self.color = color
         self.image_window = None
-        self.field_is_empty = True
+        self.canvas = Canvas(board['width'], board['height'])
+        self.replay_canvas = None
         self.setupUi(self)
 
-        self.setWindowTitle(f"{self.room}. {self.name}")
-        self.textEdit.append('Добро пожаловать в игру!\n'
-                             'Условия для начала игры:\n'
-                             '1. Количество игроков >= 2\n'
-                             '2. Все игроки нажали на кнопку "Ready"\n')
         self.lineEdit.setPlaceholderText("Введите сообщение...")
         self.pushButton.clicked.connect(self.exit)
         self.pushButton_2.clicked.connect(self.send)
@@ -246,56 +429,142 @@ class GameWindow(QMainWindow, Ui_GameWindow):
         self.comm.start_game.connect(self.start_game)
         self.comm.end_game.connect(self.end_game)
         self.comm.continue_game.connect(self.continue_game)
+        self.comm.resume_game.connect(self.resume_game)
+        self.comm.chunk_updater.connect(self.update_chunk)
         self.comm.exit_app.connect(self.exit_app)
         self.comm.update_timer.connect(self.update_timer)
+        self.comm.game_timer.connect(self.start_countdown)
+        self.comm.pixel_rejected.connect(self.pixel_rejected)
+        self.comm.replay_start.connect(self.replay_start)
+        self.comm.replay_moves.connect(self.replay_pixels)
+        self.comm.replay_end.connect(self.replay_end)
 
-        self.buttons_map = {}
+        self.deadline = 0.0
+        self.countdown = QTimer(self)
+        self.countdown.setInterval(COUNTDOWN_INTERVAL)
+        self.countdown.timeout.connect(self.show_countdown)
 
-        for x in range(25):
-            for y in range(25):
-                cell = QPushButton()
-                cell.setMaximumSize(25, 25)
-                cell.setMinimumSize(25, 25)
-                cell.clicked.connect(lambda clicked, X=x, Y=y: self.game_clicker(X, Y))
-                cell.setStyleSheet('background-color: white; border: 1px solid black; padding: 0;')
-                cell.setEnabled(False)
-                self.gridLayout_3.addWidget(cell, x, y, 1, 1)
-                self.buttons_map[(x, y)] = cell
+        self.board = CanvasWidget(self.canvas)
+        self.board.cell_clicked.connect(self.game_clicker)
+        self.board.viewport_changed.connect(self.send_viewport)
+        self.gridLayout_3.addWidget(self.board, 0, 0, 1, 1)
 
+        self.reset(room, color, board)
+
+    def reset(self, room, color, board):
+        self.room = room
+        self.color = color
+        self.deadline = 0.0
+        self.countdown.stop()
+        self.stop_replay()
+        if (self.canvas.width, self.canvas.height) != (board['width'], board['height']):
+            self.canvas = Canvas(board['width'], board['height'])
+            self.board.set_canvas(self.canvas)
+            self.board.fit()
+        self.board.set_active(False)
+        if self.client.version is None:
+            self.clear_board()
+        self.field_is_empty = not any(self.canvas.pixels)
+
+        self.setWindowTitle(f"{self.room}. {self.name}")
+        self.label.setText('01:00')
+        self.pushButton_3.setEnabled(True)
+        self.lineEdit.clear()
+        self.textEdit.clear()
+        self.textEdit.append('Добро пожаловать в игру!\n'
+                             'Условия для начала игры:\n'
+                             '1. Количество игроков >= 2\n'
+                             '2. Все игроки нажали на кнопку "Ready"\n')
         self.show()
+        self.board.chunks = None
+        self.board.emit_viewport()
 
     def ready(self):
-        self.client.send_message(dict(data='',
+        self.client.send_message(dict(data=self.client.version or '',
                                       msgtype='ready'))
         self.pushButton_3.setEnabled(False)
 
     @pyqtSlot(str)
     def start_game(self, message):
         self.textEdit.append(message)
-        for x in range(25):
-            for y in range(25):
-                cell = self.buttons_map[(x, y)]
-                cell.setEnabled(True)
-
-    @pyqtSlot(dict)
-    def continue_game(self, data):
-        self.textEdit.append("Игра уже идет!")
+        self.stop_replay()
+        self.board.set_active(True)
 
-        for (x, y), color in data.items():
-            cell = self.buttons_map[(x, y)]
-            cell.setStyleSheet(f'background-color: {color}; border: 1px solid black; padding: 0;')
-            cell.setEnabled(False)
+    @pyqtSlot(object)
+    def continue_game(self, canvas):
+        self.canvas = canvas
+        self.replay_canvas = None
+        self.board.set_canvas(canvas)
+        self.field_is_empty = not any(canvas.pixels)
+        self.resume_game()
 
-        for (x, y), cell in self.buttons_map.items():
-            if (x, y) not in data:
-                cell.setEnabled(True)
+    @pyqtSlot()
+    def resume_game(self):
+        if not self.board.active:
+            self.textEdit.append("Игра уже идет!")
+            self.board.set_active(True)
+
+    @pyqtSlot(int, int, int, int, bytes)
+    def update_chunk(self, x, y, width, height, pixels):
+        self.canvas.paste(x, y, width, height, pixels)
+        if self.replay_canvas is None:
+            self.board.refresh(x, y, width, height)
+        if self.field_is_empty:
+            self.field_is_empty = not any(self.canvas.pixels)
+
+    @pyqtSlot(int, int, int, int)
+    def send_viewport(self, x, y, width, height):
+        self.client.send_message(dict(data=(x, y, width, height),
+                                      msgtype='viewport'))
 
     def send(self):
         message = self.lineEdit.text()
+        if message.startswith('/replay'):
+            self.request_replay(message.split()[1:])
+            return
         self.client.send_message(dict(data=f'{message}',
                                       msgtype='chat'))
         self.lineEdit.clear()
 
+    def request_replay(self, args):
+        try:
+            speed = float(args[0]) if args else REPLAY_SPEED
+        except ValueError:
+            self.textEdit.append('Использование: /replay [скорость]\n')
+            return
+        self.client.send_message(dict(data=(-1, speed),
+                                      msgtype='replay'))
+        self.lineEdit.clear()
+
+    @pyqtSlot(dict)
+    def replay_start(self, info):
+        self.textEdit.append(f"Повтор раунда: {info['moves']} ходов.\n")
+        self.replay_canvas = Canvas(info['width'], info['height'])
+        self.board.set_canvas(self.replay_canvas)
+
+    @pyqtSlot(list)
+    def replay_pixels(self, pixels):
+        if self.replay_canvas is None:
+            return
+        for x, y, rgb in pixels:
+            self.replay_canvas.set(x, y, rgb)
+        self.board.set_pixels(pixels)
+
+    @pyqtSlot()
+    def replay_end(self):
+        if self.replay_canvas is not None:
+            self.textEdit.append('Повтор окончен.\n')
+        self.stop_replay()
+
+    def stop_replay(self):
+        if self.replay_canvas is not None:
+            self.replay_canvas = None
+            self.board.set_canvas(self.canvas)
+
+    def clear_board(self):
+        self.canvas.clear()
+        self.board.refresh(0, 0, self.canvas.width, self.canvas.height)
+
     def exit(self):
         self.client.send_message(dict(data='',
                                       msgtype='exit'))
@@ -309,33 +578,47 @@ class GameWindow(QMainWindow, Ui_GameWindow):
                 self.image_window = ImageWindow(QPixmap(path), self.name)
             else:
                 print("Failed to save or locate the image. No window will be shown.")
-            for x in range(25):
-                for y in range(25):
-                    cell = self.buttons_map[(x, y)]
-                    cell.setStyleSheet('background-color: white; border: 1px solid black; padding: 0;')
-                    cell.setEnabled(False)
             self.pushButton_3.setEnabled(True)
             self.field_is_empty = True
+            self.board.set_active(False)
+            self.clear_board()
 
         except Exception as e:
             print(f"Error in end_game: {e}")
 
+    @pyqtSlot(int, int)
     def game_clicker(self, X, Y):
-        self.client.send_message(dict(data=f'{X} {Y} {self.color}',
+        self.client.send_message(dict(data=(X, Y, protocol.color_to_rgb(self.color)),
                                       msgtype='game'))
 
     @pyqtSlot(int)
     def update_timer(self, new_time):
+        self.countdown.stop()
         self.label.setText(f'You have {new_time} seconds')
 
-    @pyqtSlot(str)
-    def update_game(self, coordinates):
+    @pyqtSlot(int)
+    def pixel_rejected(self, retry_ms):
+        self.statusbar.showMessage('Слишком часто! Подождите немного.', max(retry_ms, 1000))
+
+    @pyqtSlot(float)
+    def start_countdown(self, remaining):
+        self.deadline = time.monotonic() + remaining
+        self.show_countdown()
+        self.countdown.start()
+
+    def show_countdown(self):
+        remaining = max(0, math.ceil(self.deadline - time.monotonic()))
+        self.label.setText(f'You have {remaining} seconds')
+        if not remaining:
+            self.countdown.stop()
+
+    @pyqtSlot(list)
+    def update_game(self, pixels):
         self.field_is_empty = False
-        x, y, color = tuple(coordinates.split())
-        print(x, y, color)
-        cell: QPushButton = self.buttons_map[(int(x), int(y))]
-        cell.setStyleSheet(f'background-color: {color}; border: 1px solid black; padding: 0;')
-        cell.setEnabled(False)
+        for x, y, rgb in pixels:
+            self.canvas.set(x, y, rgb)
+        if self.replay_canvas is None:
+            self.board.set_pixels(pixels)
 
     @pyqtSlot(str)
     def update_chat(self, message):
@@ -347,7 +630,7 @@ class GameWindow(QMainWindow, Ui_GameWindow):
 
     @pyqtSlot()
     def exit_app(self):
-        self.deleteLater()
+        self.hide()
         if not self.field_is_empty:
             path = self.save_field_as_image()
             self.image_window = ImageWindow(QPixmap(path), self.name, self.choose_room_window)
@@ -355,29 +638,15 @@ class GameWindow(QMainWindow, Ui_GameWindow):
             self.choose_room_window.show()
 
     def save_field_as_image(self):
-        width = 25 * 25
-        height = 25 * 25
-
-        image = QImage(width, height, QImage.Format.Format_RGB32)
-        image.fill(Qt.GlobalColor.white)
-
-        painter = QPainter(image)
-        for y in range(25):
-            for x in range(25):
-                cell: QPushButton = self.buttons_map[(x, y)]
-                rect = QRect(y * 25, x * 25, 25, 25)
-                pixmap = cell.grab()
-                painter.drawPixmap(rect, pixmap)
-        painter.end()
-
+        scale = max(1, 625 // max(self.canvas.width, self.canvas.height))
         image_path = f"{self.name}.png"
-        success = image.save(image_path)
 
-        if success:
-            return image_path
-        else:
+        try:
+            export.save_png(image_path, self.canvas, scale)
+        except OSError:
             print("Ошибка сохранения изображения.")
             return None
+        return image_path
 
 
 class ImageWindow(QWidget):
@@ -406,9 +675,13 @@ class ImageWindow(QWidget):
             self.next_window.show()
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
     app = QApplication([])
 
-    start_window = Registration()
+    start_window = Registration(args.verbose)
     start_window.show()
 
     app.exec()
@@ -0,0 +1,337 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import pickle
+import socket
+from collections import Counter
+
+import protocol
+import ratelimit
+from scheduler import LoopScheduler
+from server import (AsyncClientHandler, AsyncGameServer, StreamConnection,
+                    room_not_free, valid_room_name, BACKLOG, ROOM_CAPACITY, ROOM_NAMES)
+
+REPORT_INTERVAL = 1.0
+CHANNEL_MESSAGE_SIZE = 256 * 1024
+
+
+class WorkerClientHandler(AsyncClientHandler):
+    def __init__(self, client, rooms):
+        super().__init__(client, rooms)
+        self.reader = None
+        self.returned = None
+
+    async def run(self, reader, pending=b''):
+        self.reader = reader
+        await super().run(reader, pending)
+
+    def dispatch(self, data):
+        if self.returned is None:
+            super().dispatch(data)
+        else:
+            self.returned.append(data)
+
+    def join_room(self, room_name):
+        self.returned = [dict(data=room_name, msgtype='room')]
+        self.client.writer.transport.pause_reading()
+        self.reader.feed_eof()
+
+    def disconnect(self):
+        if self.returned is None:
+            super().disconnect()
+        elif self.room:
+            self.room.leave(self.client, self.name)
+
+
+class WorkerServer(AsyncGameServer):
+    permanent_rooms = ()
+    idle_timeout = 0
+
+    def __init__(self, channel, width=25, height=25, archive_dir=None, capacity=ROOM_CAPACITY,
+                 limits=None, tick_interval=None, data_dir=None):
+        super().__init__(None, None, width, height, archive_dir, capacity=capacity,
+                         limits=limits, tick_interval=tick_interval, data_dir=data_dir)
+        self.channel = channel
+        self.adopted = Counter()
+        self.tasks = set()
+        self.stopped: asyncio.Future | None = None
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        self.loop = loop
+        self.scheduler = LoopScheduler(loop)
+        self.stopped = loop.create_future()
+        self.channel.setblocking(False)
+        loop.add_reader(self.channel.fileno(), self.receive_message)
+        self.spawn(self.report_load())
+        await self.stopped
+
+    def spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def receive_message(self):
+        try:
+            message, fds, _, _ = socket.recv_fds(self.channel, CHANNEL_MESSAGE_SIZE, 1)
+        except BlockingIOError:
+            return
+        if not message:
+            asyncio.get_running_loop().remove_reader(self.channel.fileno())
+            self.stopped.set_result(None)
+            return
+        match pickle.loads(message):
+            case ('hand_off', name, room_name, pending, version):
+                self.spawn(self.adopt(socket.socket(fileno=fds[0]), name, room_name, pending,
+                                      version))
+
+            case ('release', room_name, count):
+                self.adopted[room_name] -= count
+                if self.adopted[room_name] <= 0:
+                    del self.adopted[room_name]
+
+    async def adopt(self, client_socket, name, room_name, pending, version):
+        reader, writer = await asyncio.open_connection(sock=client_socket)
+        self.adopted[room_name] += 1
+        connection = StreamConnection(writer)
+        connection.codec_version = version
+        handler = WorkerClientHandler(connection, self.rooms)
+        handler.name = name
+        if not handler.enter_room(room_name):
+            await self.hand_back(writer, name, True, pending, version)
+            return
+        await handler.run(reader, pending)
+        if handler.returned is not None:
+            await self.hand_back(writer, handler.name, False,
+                                 protocol.encode_many(handler.returned) +
+                                 bytes(handler.decoder.buffer),
+                                 connection.codec_version)
+
+    async def hand_back(self, writer, name, rejected, pending, version):
+        writer.transport.set_write_buffer_limits(0)
+        try:
+            await writer.drain()
+            socket.send_fds(self.channel,
+                            [pickle.dumps(('hand_back', name, rejected, pending, version))],
+                            [writer.get_extra_info('socket').fileno()])
+        except (ConnectionError, OSError):
+            pass
+        writer.close()
+
+    async def report_load(self):
+        while True:
+            self.rooms.reap()
+            report = dict(players={room.name: len(room.clients) for room in self.rooms},
+                          active=list(self.rooms.active),
+                          adopted=dict(self.adopted))
+            try:
+                self.channel.send(pickle.dumps(('report', report)))
+            except BlockingIOError:
+                pass
+            except OSError as error:
+                print(f'Не удалось отправить отчет о нагрузке: {error}')
+            await asyncio.sleep(REPORT_INTERVAL)
+
+
+def run_worker(channel, width, height, archive_dir, capacity, limits, tick_interval, data_dir):
+    WorkerServer(channel, width, height, archive_dir, capacity, limits, tick_interval,
+                 data_dir).start()
+
+
+class ClusterServer:
+    def __init__(self, host, port, workers, width=25, height=25, archive_dir=None,
+                 capacity=ROOM_CAPACITY, limits=None, tick_interval=None, data_dir=None):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.width = width
+        self.height = height
+        self.archive_dir = archive_dir
+        self.capacity = capacity
+        self.limits = limits
+        self.tick_interval = tick_interval
+        self.data_dir = data_dir
+        self.free_rooms = list(ROOM_NAMES)
+        self.channels = []
+        self.processes = []
+        self.owners = {}
+        self.sent = Counter()
+        self.reports = [dict(players={}, active=[], adopted={}) for _ in range(workers)]
+        self.tasks = set()
+        self.context = multiprocessing.get_context('spawn')
+
+    def start(self):
+        for _ in range(self.workers):
+            front_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            process = self.context.Process(target=run_worker,
+                                           args=(worker_end, self.width, self.height,
+                                                 self.archive_dir, self.capacity, self.limits,
+                                                 self.tick_interval, self.data_dir),
+                                           daemon=True)
+            process.start()
+            worker_end.close()
+            self.channels.append(front_end)
+            self.processes.append(process)
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        for index, channel in enumerate(self.channels):
+            loop.add_reader(channel.fileno(), self.receive_message, index)
+
+        listener = socket.create_server((self.host, self.port), backlog=BACKLOG)
+        listener.setblocking(False)
+        print("Ожидание подключение игроков...")
+        while True:
+            client_socket, client_address = await loop.sock_accept(listener)
+            print(f'Подключен {client_address}')
+            self.spawn(self.route(client_socket))
+
+    def spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def route(self, client_socket, name='', pending=b'',
+                    version=protocol.BASE_CODEC_VERSION):
+        loop = asyncio.get_running_loop()
+        decoder = protocol.client_decoder()
+        try:
+            packets = decoder.feed(pending)
+            while True:
+                for index, data in enumerate(packets):
+                    match data['msgtype']:
+                        case 'hello':
+                            version = protocol.negotiate(data['data'])
+                            await loop.sock_sendall(client_socket,
+                                                    protocol.hello([version] if version else []))
+                            if version is None:
+                                client_socket.close()
+                                return
+
+                        case 'name':
+                            name = data['data']
+                            await loop.sock_sendall(client_socket,
+                                                    protocol.encode(dict(data=self.free_rooms,
+                                                                         msgtype='free_rooms'),
+                                                                    version))
+
+                        case 'room' if valid_room_name(data['data']):
+                            pending = protocol.encode_many(packets[index + 1:]) + bytes(decoder.buffer)
+                            self.hand_off(client_socket, name, data['data'], pending, version)
+                            return
+
+                        case 'room':
+                            await loop.sock_sendall(client_socket,
+                                                    protocol.encode(room_not_free(self.free_rooms),
+                                                                    version))
+
+                data_in_bytes = await loop.sock_recv(client_socket, protocol.RECV_SIZE)
+
+                if not data_in_bytes:
+                    break
+
+                packets = decoder.feed(data_in_bytes)
+
+        except (ConnectionError, OSError, protocol.FrameError):
+            pass
+        client_socket.close()
+
+    def hand_off(self, client_socket, name, room_name, pending, version):
+        worker = self.owner_of(room_name)
+        socket.send_fds(self.channels[worker],
+                        [pickle.dumps(('hand_off', name, room_name, pending, version))],
+                        [client_socket.fileno()])
+        self.sent[(worker, room_name)] += 1
+        client_socket.close()
+
+    def owner_of(self, room_name):
+        worker = self.owners.get(room_name)
+        if worker is None:
+            worker = min(range(self.workers), key=self.load)
+            self.owners[room_name] = worker
+        return worker
+
+    def load(self, worker):
+        report = self.reports[worker]
+        in_flight = sum(count - report['adopted'].get(room_name, 0)
+                        for (owner, room_name), count in self.sent.items()
+                        if owner == worker)
+        return sum(report['players'].values()) + in_flight
+
+    def receive_message(self, worker):
+        message, fds, _, _ = socket.recv_fds(self.channels[worker], CHANNEL_MESSAGE_SIZE, 1)
+        if not message:
+            asyncio.get_running_loop().remove_reader(self.channels[worker].fileno())
+            return
+        match pickle.loads(message):
+            case ('report', report):
+                self.receive_report(worker, report)
+
+            case ('hand_back', name, rejected, pending, version):
+                client_socket = socket.socket(fileno=fds[0])
+                client_socket.setblocking(False)
+                self.spawn(self.take_back(client_socket, name, rejected, pending, version))
+
+    async def take_back(self, client_socket, name, rejected, pending, version):
+        if rejected:
+            try:
+                await asyncio.get_running_loop().sock_sendall(
+                    client_socket, protocol.encode(room_not_free(self.free_rooms), version))
+            except OSError:
+                client_socket.close()
+                return
+        await self.route(client_socket, name, pending, version)
+
+    def receive_report(self, worker, report):
+        self.reports[worker] = report
+        for room_name, owner in list(self.owners.items()):
+            if owner != worker or report['players'].get(room_name):
+                continue
+            count = self.sent[(worker, room_name)]
+            if report['adopted'].get(room_name, 0) != count:
+                continue
+            del self.owners[room_name]
+            if count:
+                del self.sent[(worker, room_name)]
+                self.channels[worker].send(pickle.dumps(('release', room_name, count)))
+        self.update_free_rooms()
+
+    def update_free_rooms(self):
+        players = {}
+        active = set()
+        for report in self.reports:
+            players.update(report['players'])
+            active.update(report['active'])
+        names = dict.fromkeys(ROOM_NAMES)
+        names.update(dict.fromkeys(players))
+        self.free_rooms = [name for name in names
+                           if name not in active and players.get(name, 0) < self.capacity]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3435)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--width', type=int, default=25)
+    parser.add_argument('--height', type=int, default=25)
+    parser.add_argument('--archive-dir')
+    parser.add_argument('--room-capacity', type=int, default=ROOM_CAPACITY)
+    ratelimit.add_arguments(parser)
+    parser.add_argument('--tick-ms', type=int, default=0)
+    parser.add_argument('--data-dir')
+    args = parser.parse_args()
+
+    if args.archive_dir:
+        os.makedirs(args.archive_dir, exist_ok=True)
+    cluster = ClusterServer(args.host, args.port, args.workers,
+                            args.width, args.height, args.archive_dir, args.room_capacity,
+                            ratelimit.from_arguments(args), args.tick_ms / 1000 or None,
+                            args.data_dir)
+    cluster.start()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import struct
+
+BYTE = struct.Struct('!B')
+LENGTH = struct.Struct('!I')
+PREFIX = struct.Struct('!BB')
+MAX_DEPTH = 16
+
+
+class Scalar:
+    def __init__(self, code, types):
+        self.code = code
+        self.types = types
+        self.struct = struct.Struct('!' + code)
+
+    def accepts(self, value):
+        return isinstance(value, self.types) and not isinstance(value, bool)
+
+    def pack(self, value):
+        return self.struct.pack(value)
+
+    def unpack(self, data, offset):
+        return self.struct.unpack_from(data, offset)[0], offset + self.struct.size
+
+
+class Int(Scalar):
+    def __init__(self):
+        super().__init__('q', int)
+
+
+class Float(Scalar):
+    def __init__(self):
+        super().__init__('d', (int, float))
+
+
+class Null:
+    code = ''
+
+    def accepts(self, value):
+        return value is None
+
+    def pack(self, value):
+        return b''
+
+    def unpack(self, data, offset):
+        return None, offset
+
+
+class Str:
+    code = None
+
+    def accepts(self, value):
+        return isinstance(value, str)
+
+    def pack(self, value):
+        value = value.encode()
+        return LENGTH.pack(len(value)) + value
+
+    def unpack(self, data, offset):
+        (size,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        end = offset + size
+        if end > len(data):
+            raise ValueError('truncated string')
+        return data[offset:end].decode(), end
+
+
+class Bytes:
+    code = None
+
+    def accepts(self, value):
+        return isinstance(value, (bytes, bytearray))
+
+    def pack(self, value):
+        return LENGTH.pack(len(value)) + value
+
+    def unpack(self, data, offset):
+        (size,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        end = offset + size
+        if end > len(data):
+            raise ValueError('truncated bytes')
+        return data[offset:end], end
+
+
+class Record:
+    def __init__(self, fields):
+        self.fields = fields
+        codes = [field.code for field in fields]
+        self.struct = struct.Struct('!' + ''.join(codes)) if None not in codes else None
+        self.code = self.struct.format[1:] if self.struct else None
+
+    def pack_values(self, values):
+        if self.struct:
+            return self.struct.pack(*values)
+        return b''.join([field.pack(value) for field, value in zip(self.fields, values)])
+
+    def unpack_values(self, data, offset):
+        if self.struct:
+            return self.struct.unpack_from(data, offset), offset + self.struct.size
+        values = []
+        for field in self.fields:
+            value, offset = field.unpack(data, offset)
+            values.append(value)
+        return values, offset
+
+
+class Tuple(Record):
+    def __init__(self, *items):
+        super().__init__(items)
+
+    def accepts(self, value):
+        return (isinstance(value, (tuple, list)) and len(value) == len(self.fields) and
+                all(item.accepts(element) for item, element in zip(self.fields, value)))
+
+    def pack(self, value):
+        if len(value) != len(self.fields):
+            raise ValueError(f'expected {len(self.fields)} items, got {len(value)}')
+        return self.pack_values(value)
+
+    def unpack(self, data, offset):
+        values, offset = self.unpack_values(data, offset)
+        return tuple(values), offset
+
+
+class Dict(Record):
+    def __init__(self, **fields):
+        super().__init__(tuple(fields.values()))
+        self.names = tuple(fields)
+
+    def accepts(self, value):
+        return (isinstance(value, dict) and len(value) == len(self.fields) and
+                all(name in value and field.accepts(value[name])
+                    for name, field in zip(self.names, self.fields)))
+
+    def pack(self, value):
+        return self.pack_values([value[name] for name in self.names])
+
+    def unpack(self, data, offset):
+        values, offset = self.unpack_values(data, offset)
+        return dict(zip(self.names, values)), offset
+
+
+class List:
+    code = None
+
+    def __init__(self, item):
+        self.item = item
+
+    def accepts(self, value):
+        return isinstance(value, (tuple, list)) and all(self.item.accepts(element)
+                                                        for element in value)
+
+    def pack(self, value):
+        pack = self.item.pack
+        return LENGTH.pack(len(value)) + b''.join([pack(element) for element in value])
+
+    def unpack(self, data, offset):
+        (count,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        if count > len(data) - offset:
+            raise ValueError('list longer than frame')
+        unpack = self.item.unpack
+        values = []
+        for _ in range(count):
+            value, offset = unpack(data, offset)
+            values.append(value)
+        return values, offset
+
+
+class Union:
+    code = None
+
+    def __init__(self, *options):
+        self.options = options
+
+    def accepts(self, value):
+        return any(option.accepts(value) for option in self.options)
+
+    def pack(self, value):
+        for index, option in enumerate(self.options):
+            if option.accepts(value):
+                return BYTE.pack(index) + option.pack(value)
+        raise ValueError(f'{value!r} does not match schema')
+
+    def unpack(self, data, offset):
+        index = data[offset]
+        if index >= len(self.options):
+            raise ValueError('bad union tag')
+        return self.options[index].unpack(data, offset + 1)
+
+
+class Ints:
+    code = None
+
+    def pack(self, value):
+        return LENGTH.pack(len(value)) + struct.pack(f'!{len(value)}q', *value)
+
+    def unpack(self, data, offset):
+        (count,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        if count * 8 > len(data) - offset:
+            raise ValueError('list longer than frame')
+        return struct.unpack_from(f'!{count}q', data, offset), offset + count * 8
+
+
+class Any:
+    code = None
+
+    def __init__(self, depth=MAX_DEPTH):
+        items = List(Any(depth - 1)) if depth else None
+        self.options = (Null(), Int(), Float(), Str(), Bytes(), items, items, Ints())
+        self.tags = {type(None): 0, int: 1, float: 2, str: 3, bytes: 4, list: 5, tuple: 6}
+
+    def accepts(self, value):
+        return True
+
+    def pack(self, value):
+        index = self.tags.get(type(value))
+        if index is None:
+            raise ValueError(f'{type(value).__name__} is not supported')
+        if index == 6 and all(type(element) is int for element in value):
+            index = 7
+        if self.options[index] is None:
+            raise ValueError('value nested too deeply')
+        return BYTE.pack(index) + self.options[index].pack(value)
+
+    def unpack(self, data, offset):
+        index = data[offset]
+        if index >= len(self.options):
+            raise ValueError('bad value tag')
+        if self.options[index] is None:
+            raise ValueError('value nested too deeply')
+        value, offset = self.options[index].unpack(data, offset + 1)
+        return (tuple(value) if index == 6 else value), offset
+
+
+TEXT = Str()
+NUMBER = Int()
+REPLAY_INFO = Dict(started=Float(), moves=NUMBER, duration=NUMBER)
+
+MESSAGES_V1 = (
+    ('hello', List(NUMBER)),
+    ('name', TEXT),
+    ('room', TEXT),
+    ('color', TEXT),
+    ('new_player', TEXT),
+    ('ready', Union(TEXT, NUMBER)),
+    ('exit', TEXT),
+    ('viewport', Tuple(NUMBER, NUMBER, NUMBER, NUMBER)),
+    ('sync', NUMBER),
+    ('chat', TEXT),
+    ('exit_color_window', TEXT),
+    ('replays', Union(Null(), List(REPLAY_INFO))),
+    ('replay', Tuple(NUMBER, Float())),
+    ('free_rooms', List(TEXT)),
+    ('room_info', Dict(width=NUMBER, height=NUMBER)),
+    ('room_not_free', Dict(message=TEXT, rooms=List(TEXT))),
+    ('start_game', TEXT),
+    ('end_game', TEXT),
+    ('color_free', TEXT),
+    ('color_not_free', TEXT),
+    ('exit_app', TEXT),
+    ('resume_game', NUMBER),
+    ('update_timer', NUMBER),
+    ('game_timer', Dict(ends_at=Float(), remaining=Float())),
+    ('replay_start', Dict(width=NUMBER, height=NUMBER, started=Float(), moves=NUMBER)),
+    ('replay_end', TEXT),
+    ('subscribe', TEXT),
+    ('unsubscribe', TEXT),
+    ('publish', Tuple(TEXT, Tuple(NUMBER, TEXT, Any()))),
+)
+
+
+class SchemaCodec:
+    def __init__(self, version, tag, messages):
+        self.version = version
+        self.tag = tag
+        self.by_name = {name: (PREFIX.pack(tag, index), schema)
+                        for index, (name, schema) in enumerate(messages)}
+        self.by_index = messages
+
+    def encode(self, packet):
+        entry = self.by_name.get(packet['msgtype'])
+        if entry is None:
+            raise ValueError(f"no schema for msgtype {packet['msgtype']!r}")
+        prefix, schema = entry
+        return prefix + schema.pack(packet['data'])
+
+    def decode(self, data, msgtypes=None):
+        index = data[1]
+        if index >= len(self.by_index):
+            raise ValueError('unknown msgtype')
+        msgtype, schema = self.by_index[index]
+        if msgtypes is not None and msgtype not in msgtypes:
+            raise ValueError(f'unexpected msgtype {msgtype!r}')
+        value, offset = schema.unpack(data, PREFIX.size)
+        if offset != len(data):
+            raise ValueError('trailing bytes in packet')
+        return dict(data=value, msgtype=msgtype)
+
+
+CODECS = (SchemaCodec(1, 0x10, MESSAGES_V1),)
@@ -0,0 +1,47 @@
+import struct
+import zlib
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+EMPTY_PIXEL = bytes(4)
+WHITE_PIXEL = b'\xff' * 4
+
+
+def png_chunk(kind, data):
+    return b''.join((struct.pack('!I', len(data)), kind, data,
+                     struct.pack('!I', zlib.crc32(kind + data))))
+
+
+def canvas_to_rgb(canvas, scale=1):
+    # Snapshot bytes are B, G, R, A per cell and empty cells are all zero,
+    # so aligned zero words can be whitened with a plain bytes.replace.
+    bgra = bytes(canvas.snapshot()).replace(EMPTY_PIXEL, WHITE_PIXEL)
+    rgb = bytearray(len(bgra) // 4 * 3 * scale)
+    step = 3 * scale
+    for repeat in range(scale):
+        rgb[repeat * 3::step] = bgra[2::4]
+        rgb[repeat * 3 + 1::step] = bgra[1::4]
+        rgb[repeat * 3 + 2::step] = bgra[0::4]
+    return rgb
+
+
+def encode_png(canvas, scale=1):
+    width = canvas.width * scale
+    height = canvas.height * scale
+    stride = width * 3
+    rgb = canvas_to_rgb(canvas, scale)
+
+    rows = []
+    for y in range(canvas.height):
+        row = b'\x00' + rgb[y * stride:(y + 1) * stride]
+        rows.extend([row] * scale)
+
+    header = struct.pack('!IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b''.join((PNG_SIGNATURE,
+                     png_chunk(b'IHDR', header),
+                     png_chunk(b'IDAT', zlib.compress(b''.join(rows), 6)),
+                     png_chunk(b'IEND', b'')))
+
+
+def save_png(path, canvas, scale=1):
+    with open(path, 'wb') as file:
+        file.write(encode_png(canvas, scale))
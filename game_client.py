@@ -0,0 +1,285 @@
+import socket
+import threading
+import time
+import traceback
+from collections import defaultdict
+
+import protocol
+
+HOST = '127.0.0.1'
+PORT = 3435
+FRAME_INTERVAL = 0.016
+OUTBOX_PIXELS = 256
+IOV_MAX = 1024
+CONNECT_TIMEOUT = 5.0
+RETRY_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+PIXELS = 'pixels'
+DISCONNECTED = 'disconnected'
+ANY = '*'
+
+
+class Outbox:
+    def __init__(self, max_pixels=OUTBOX_PIXELS):
+        self.max_pixels = max_pixels
+        self.pending = {}
+        self.pixels = 0
+        self.sequence = 0
+        self.closed = False
+        self.merged = 0
+        self.dropped = 0
+        self.condition = threading.Condition()
+
+    def put(self, packet, version=protocol.BASE_CODEC_VERSION):
+        frame = protocol.encode(packet, version)
+        with self.condition:
+            if packet['msgtype'] == 'game':
+                key = packet['data'][:2]
+                if key in self.pending:
+                    self.pending[key] = frame
+                    self.merged += 1
+                    return True
+                if self.pixels >= self.max_pixels:
+                    self.dropped += 1
+                    return False
+                self.pixels += 1
+            else:
+                self.sequence += 1
+                key = self.sequence
+            self.pending[key] = frame
+            self.condition.notify()
+            return True
+
+    def take(self):
+        with self.condition:
+            while not self.pending and not self.closed:
+                self.condition.wait()
+            frames = list(self.pending.values())
+            self.pending.clear()
+            self.pixels = 0
+            return frames
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+
+def send_frames(sock, frames):
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(frames))
+        return
+    while frames:
+        batch = frames[:IOV_MAX]
+        sent = sock.sendmsg(batch)
+        frames = frames[IOV_MAX:]
+        for index, frame in enumerate(batch):
+            if sent < len(frame):
+                frames[:0] = [memoryview(frame)[sent:]] + batch[index + 1:]
+                break
+            sent -= len(frame)
+
+
+class GameClient:
+    def __init__(self, host=HOST, port=PORT, verbose=False, connect=True):
+        self.host = host
+        self.port = port
+        self.socket = None
+        self.isConnected = False
+        self.closed = False
+        self.verbose = verbose
+        self.version = None
+        self.room = None
+        self.joining = None
+        self.codec_version = protocol.BASE_CODEC_VERSION
+        self.outbox = Outbox()
+        self.handlers = defaultdict(list)
+        self.pending_pixels = {}
+        self.pixels_lock = threading.Lock()
+        self.pixels_ready = threading.Event()
+        self.state_lock = threading.Lock()
+        self.outbox.put(dict(data=sorted(protocol.CODECS), msgtype='hello'))
+        if connect:
+            self.connect()
+
+    def connect(self):
+        self.socket = socket.create_connection((self.host, self.port), CONNECT_TIMEOUT)
+        self.socket.settimeout(None)
+        self.isConnected = True
+
+        threading.Thread(target=self.receive_messages, daemon=True).start()
+        threading.Thread(target=self.send_msg, daemon=True).start()
+        threading.Thread(target=self.deliver_pixels, daemon=True).start()
+
+    def connect_with_retry(self, on_retry=None, attempts=None):
+        delay = RETRY_DELAY
+        attempt = 0
+        while not self.closed:
+            attempt += 1
+            try:
+                self.connect()
+                return True
+            except OSError as error:
+                if attempts and attempt >= attempts:
+                    raise
+                if on_retry:
+                    on_retry(attempt, delay, error)
+            time.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+        return False
+
+    def on(self, msgtype, callback):
+        self.handlers[msgtype].append(callback)
+        return callback
+
+    def off(self, msgtype, callback):
+        if callback in self.handlers.get(msgtype, ()):
+            self.handlers[msgtype].remove(callback)
+
+    def emit(self, msgtype, data=None):
+        for callback in list(self.handlers.get(msgtype, ())):
+            self.call(callback, data)
+        for callback in list(self.handlers.get(ANY, ())):
+            self.call(callback, msgtype, data)
+
+    def call(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            print(f'Ошибка в обработчике {callback!r}:')
+            traceback.print_exc()
+
+    async def events(self):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def push(msgtype, data):
+            loop.call_soon_threadsafe(queue.put_nowait, (msgtype, data))
+
+        self.on(ANY, push)
+        try:
+            if not self.isConnected:
+                return
+            while True:
+                msgtype, data = await queue.get()
+                yield msgtype, data
+                if msgtype == DISCONNECTED:
+                    return
+        finally:
+            self.off(ANY, push)
+
+    def send_msg(self):
+        while self.isConnected:
+            frames = self.outbox.take()
+            if not frames:
+                break
+            try:
+                send_frames(self.socket, frames)
+            except (ConnectionError, OSError):
+                print("Вы были отключены от сервера.")
+                self.disconnect()
+                break
+
+    def send_message(self, packet):
+        if packet['msgtype'] == 'room':
+            self.joining = packet['data']
+        return self.outbox.put(packet, self.codec_version)
+
+    def send(self, msgtype, data=''):
+        return self.send_message(dict(data=data, msgtype=msgtype))
+
+    def receive_messages(self):
+        decoder = protocol.FrameDecoder()
+        while self.isConnected:
+            try:
+                data_in_bytes = self.socket.recv(protocol.RECV_SIZE)
+
+                if not data_in_bytes:
+                    break
+
+                for data in decoder.feed(data_in_bytes):
+                    self.handle_packet(data)
+
+            except (ConnectionError, OSError, protocol.FrameError):
+                print("Вы были отключены от сервера.")
+                break
+        self.disconnect()
+
+    def disconnect(self):
+        with self.state_lock:
+            self.closed = True
+            if not self.isConnected:
+                return
+            self.isConnected = False
+        self.outbox.close()
+        self.socket.close()
+        self.pixels_ready.set()
+        self.emit(DISCONNECTED)
+
+    def close(self):
+        self.disconnect()
+
+    def deliver_pixels(self):
+        while self.isConnected:
+            self.pixels_ready.wait()
+            time.sleep(FRAME_INTERVAL)
+            self.flush_pixels()
+
+    def flush_pixels(self):
+        with self.pixels_lock:
+            self.pixels_ready.clear()
+            if not self.pending_pixels:
+                return
+            batch = [(x, y, rgb) for (x, y), rgb in self.pending_pixels.items()]
+            self.pending_pixels = {}
+            self.emit(PIXELS, batch)
+
+    def resync(self):
+        self.send_message(dict(data=self.version or 0,
+                               msgtype='sync'))
+
+    def handle_packet(self, data):
+        if self.verbose:
+            print(data)
+        if self.version is not None:
+            self.version = max(self.version, data.get('version', 0))
+        if data['msgtype'] != 'game':
+            self.flush_pixels()
+
+        match data['msgtype']:
+            case 'hello':
+                version = protocol.negotiate(data['data'])
+                if version is None:
+                    print('Сервер не поддерживает версию протокола клиента.')
+                    self.disconnect()
+                else:
+                    self.codec_version = version
+
+            case 'room_info':
+                if self.joining != self.room:
+                    self.version = None
+                self.room = self.joining
+                self.emit('room_info', data['data'])
+
+            case 'continue_game':
+                self.version = data['version']
+                self.emit('continue_game', data['data'])
+
+            case 'resume_game':
+                self.version = data['data']
+                self.emit('resume_game', data['data'])
+
+            case 'end_game' | 'exit_app' | 'exit_color_window':
+                self.version = None
+                self.emit(data['msgtype'], data['data'])
+
+            case 'game':
+                x, y, rgb = data['data']
+                with self.pixels_lock:
+                    self.pending_pixels[(x, y)] = rgb
+                self.pixels_ready.set()
+
+            case msgtype:
+                self.emit(msgtype, data['data'])
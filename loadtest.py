@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+import protocol
+
+CONNECT_TIMEOUT = 10.0
+PENDING_TIMEOUT = 5.0
+
+
+class Bot:
+    def __init__(self, host, port, name, room, rate):
+        self.name = name
+        self.room = room
+        self.rate = rate
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.decoder = protocol.FrameDecoder()
+        self.lock = threading.Lock()
+        self.board = None
+        self.joined = threading.Event()
+        self.playing = threading.Event()
+        self.stopped = threading.Event()
+        self.pending = {}
+        self.latencies = []
+        self.counts = Counter()
+        self.rng = random.Random(name)
+        self.codec_version = protocol.BASE_CODEC_VERSION
+
+    def send(self, msgtype, data=''):
+        frame = protocol.encode(dict(data=data, msgtype=msgtype), self.codec_version)
+        with self.lock:
+            self.socket.sendall(frame)
+        self.counts['sent'] += 1
+
+    def start(self):
+        threading.Thread(target=self.receive, daemon=True).start()
+        self.send('hello', sorted(protocol.CODECS))
+        self.send('name', self.name)
+        self.send('room', self.room)
+
+    def receive(self):
+        try:
+            while not self.stopped.is_set():
+                data = self.socket.recv(protocol.RECV_SIZE)
+                if not data:
+                    break
+                received = time.perf_counter()
+                for packet in self.decoder.feed(data):
+                    self.handle_packet(packet, received)
+        except OSError:
+            pass
+        self.playing.clear()
+        self.joined.set()
+
+    def handle_packet(self, data, received):
+        self.counts['received'] += 1
+        match data['msgtype']:
+            case 'hello':
+                self.codec_version = protocol.negotiate(data['data']) or self.codec_version
+
+            case 'room_info':
+                self.board = data['data']
+                self.send('color', f'#{self.rng.randrange(1 << 24):06x}')
+
+            case 'color_free':
+                self.send('new_player')
+                self.send('ready')
+                self.joined.set()
+
+            case 'color_not_free':
+                self.send('color', f'#{self.rng.randrange(1 << 24):06x}')
+
+            case 'room_not_free':
+                self.counts['rejected_rooms'] += 1
+                self.joined.set()
+
+            case 'start_game' | 'resume_game' | 'continue_game':
+                self.playing.set()
+
+            case 'end_game':
+                self.playing.clear()
+                self.send('ready')
+
+            case 'game':
+                sent = self.pending.pop(data['data'], None)
+                if sent is not None:
+                    self.latencies.append(received - sent)
+
+            case 'nack':
+                self.counts['throttled'] += 1
+
+    def play(self, deadline):
+        interval = 1 / self.rate
+        next_click = time.perf_counter()
+        while time.perf_counter() < deadline and not self.stopped.is_set():
+            if not self.playing.wait(0.1):
+                next_click = time.perf_counter()
+                continue
+            now = time.perf_counter()
+            if now < next_click:
+                time.sleep(next_click - now)
+                continue
+            next_click += interval
+            pixel = (self.rng.randrange(self.board['width']),
+                     self.rng.randrange(self.board['height']),
+                     self.rng.randrange(1 << 24))
+            self.pending[pixel] = time.perf_counter()
+            try:
+                self.send('game', pixel)
+            except OSError:
+                break
+            self.counts['pixels'] += 1
+            if len(self.pending) > 1000:
+                self.expire(now)
+
+    def expire(self, now):
+        for pixel, sent in list(self.pending.items()):
+            if now - sent > PENDING_TIMEOUT:
+                del self.pending[pixel]
+                self.counts['lost'] += 1
+
+    def stop(self):
+        self.stopped.set()
+        try:
+            self.send('exit')
+        except OSError:
+            pass
+        self.socket.close()
+
+
+def process_tree(pid):
+    pids = [pid]
+    for pid in pids:
+        try:
+            for task in os.listdir(f'/proc/{pid}/task'):
+                with open(f'/proc/{pid}/task/{task}/children') as file:
+                    pids.extend(int(child) for child in file.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def process_usage(pid):
+    cpu = 0.0
+    memory = 0
+    ticks = os.sysconf('SC_CLK_TCK')
+    for child in process_tree(pid):
+        try:
+            with open(f'/proc/{child}/stat') as file:
+                fields = file.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / ticks
+            with open(f'/proc/{child}/status') as file:
+                for line in file:
+                    if line.startswith('VmRSS:'):
+                        memory += int(line.split()[1]) * 1024
+        except (OSError, IndexError, ValueError):
+            pass
+    return cpu, memory
+
+
+def free_port(host):
+    with socket.socket() as probe:
+        probe.bind((host, 0))
+        return probe.getsockname()[1]
+
+
+def start_server(args):
+    port = free_port(args.host)
+    module = 'cluster.py' if args.target == 'cluster' else 'server.py'
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), module),
+               '--host', args.host, '--port', str(port),
+               '--room-capacity', str(max(args.bots, 2)),
+               '--pixel-rate', str(args.pixel_rate), '--room-pixel-rate', str(args.room_pixel_rate),
+               '--tick-ms', str(args.tick_ms)]
+    if args.target == 'server':
+        command += ['--mode', args.mode, '--max-rooms', str(args.rooms + 3)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((args.host, port), timeout=1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError('сервер не запустился')
+
+
+def percentile_ms(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+
+def run(args):
+    process = None
+    if args.server:
+        host, port = args.server.rsplit(':', 1)
+        port = int(port)
+    else:
+        process, port = start_server(args)
+        host = args.host
+    try:
+        bots = [Bot(host, port, f'bot{room}_{index}', f'Bench{room}', args.rate)
+                for room in range(args.rooms) for index in range(args.bots)]
+        for bot in bots:
+            bot.start()
+        for bot in bots:
+            bot.joined.wait(CONNECT_TIMEOUT)
+
+        usage = process_usage(process.pid) if process else (0.0, 0)
+        started = time.perf_counter()
+        deadline = started + args.seconds
+        threads = [threading.Thread(target=bot.play, args=(deadline,)) for bot in bots]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        cpu, memory = process_usage(process.pid) if process else (0.0, 0)
+        for bot in bots:
+            bot.stop()
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    counts = sum((bot.counts for bot in bots), Counter())
+    latencies = sorted(latency for bot in bots for latency in bot.latencies)
+    return dict(
+        config=dict(target=args.target, mode=args.mode, rooms=args.rooms, bots=args.bots,
+                    rate=args.rate, seconds=args.seconds, tick_ms=args.tick_ms,
+                    pixel_rate=args.pixel_rate, room_pixel_rate=args.room_pixel_rate),
+        elapsed=elapsed,
+        pixels=counts['pixels'],
+        pixels_per_sec=counts['pixels'] / elapsed,
+        messages_sent_per_sec=counts['sent'] / elapsed,
+        messages_received_per_sec=counts['received'] / elapsed,
+        throttled=counts['throttled'],
+        rejected_rooms=counts['rejected_rooms'],
+        latency_samples=len(latencies),
+        latency_p50_ms=percentile_ms(latencies, 0.5),
+        latency_p99_ms=percentile_ms(latencies, 0.99),
+        latency_max_ms=percentile_ms(latencies, 1.0),
+        server_cpu_sec=cpu - usage[0] if process else None,
+        server_cpu_percent=(cpu - usage[0]) / elapsed * 100 if process else None,
+        server_rss_bytes=memory if process else None,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--server', help='HOST:PORT уже запущенного сервера')
+    parser.add_argument('--target', choices=('server', 'cluster'), default='server')
+    parser.add_argument('--mode', choices=('threaded', 'asyncio'), default='threaded')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--rooms', type=int, default=4)
+    parser.add_argument('--bots', type=int, default=8, help='ботов в комнате')
+    parser.add_argument('--rate', type=float, default=10.0, help='кликов в секунду на бота')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--tick-ms', type=int, default=0)
+    parser.add_argument('--pixel-rate', type=float, default=0)
+    parser.add_argument('--room-pixel-rate', type=float, default=0)
+    parser.add_argument('--output', help='файл для JSON-результата')
+    args = parser.parse_args()
+
+    result = run(args)
+    report = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report + '\n')
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
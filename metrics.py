@@ -0,0 +1,195 @@
+import bisect
+import json
+import os
+import threading
+import time
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TIME_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+DRIFT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+FANOUT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+MAX_LABELS = 64
+DUMP_INTERVAL = 10.0
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+    def to_dict(self):
+        return dict(count=self.count, sum=self.sum,
+                    buckets={format_bound(bound): total for bound, total in self.cumulative()})
+
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+class Metrics:
+    def __init__(self):
+        self.messages = {}
+        self.broadcast_recipients = Histogram(FANOUT_BUCKETS)
+        self.broadcast_seconds = Histogram(TIME_BUCKETS)
+        self.broadcast_bytes = 0
+        self.timer_drift = Histogram(DRIFT_BUCKETS)
+        self.pixels = dict(accepted=0, player_throttled=0, room_throttled=0)
+        self.connections = weakref.WeakSet()
+        self.gauges = {}
+        self.sections = {}
+
+    def observe_message(self, msgtype, elapsed):
+        histogram = self.messages.get(msgtype)
+        if histogram is None:
+            if (not isinstance(msgtype, str) or not msgtype.isidentifier() or
+                    len(self.messages) >= MAX_LABELS):
+                msgtype = 'other'
+            histogram = self.messages.setdefault(msgtype, Histogram(TIME_BUCKETS))
+        histogram.observe(elapsed)
+
+    def observe_broadcast(self, recipients, size, elapsed):
+        self.broadcast_recipients.observe(recipients)
+        self.broadcast_seconds.observe(elapsed)
+        self.broadcast_bytes += size
+
+    def observe_pixel(self, result):
+        self.pixels[result] += 1
+
+    def observe_drift(self, drift):
+        self.timer_drift.observe(max(0.0, drift))
+
+    def add_connection(self, connection):
+        self.connections.add(connection)
+
+    def gauge(self, name, help, callback):
+        self.gauges[name] = (help, callback)
+
+    def section(self, name, callback):
+        self.sections[name] = callback
+
+    def queue_depths(self):
+        return [connection.queued() for connection in list(self.connections)]
+
+    def collect(self):
+        queued = self.queue_depths()
+        values = dict(connections=len(queued),
+                      outbox_bytes=sum(queued),
+                      outbox_max_bytes=max(queued, default=0),
+                      broadcast_bytes=self.broadcast_bytes)
+        for name, (_, callback) in list(self.gauges.items()):
+            values[name] = callback()
+        return values
+
+    def to_dict(self):
+        return dict(time=time.time(),
+                    messages={msgtype: histogram.to_dict()
+                              for msgtype, histogram in list(self.messages.items())},
+                    broadcast_recipients=self.broadcast_recipients.to_dict(),
+                    broadcast_seconds=self.broadcast_seconds.to_dict(),
+                    timer_drift_seconds=self.timer_drift.to_dict(),
+                    pixels=dict(self.pixels),
+                    **{name: callback() for name, callback in list(self.sections.items())},
+                    **self.collect())
+
+    def render(self):
+        lines = []
+        write_histogram(lines, 'pixel_message_seconds', 'Время обработки сообщения по типу',
+                        [(f'msgtype="{msgtype}"', histogram)
+                         for msgtype, histogram in sorted(list(self.messages.items()))])
+        write_histogram(lines, 'pixel_broadcast_recipients', 'Получателей одной рассылки',
+                        [('', self.broadcast_recipients)])
+        write_histogram(lines, 'pixel_broadcast_seconds', 'Время одной рассылки',
+                        [('', self.broadcast_seconds)])
+        write_histogram(lines, 'pixel_timer_drift_seconds', 'Опоздание срабатывания таймера',
+                        [('', self.timer_drift)])
+        lines += ['# HELP pixel_broadcast_bytes_total Байт отправлено рассылками',
+                  '# TYPE pixel_broadcast_bytes_total counter',
+                  f'pixel_broadcast_bytes_total {self.broadcast_bytes}',
+                  '# HELP pixel_pixels_total Пиксели от игроков по результату ограничения частоты',
+                  '# TYPE pixel_pixels_total counter']
+        lines += [f'pixel_pixels_total{{result="{result}"}} {count}'
+                  for result, count in list(self.pixels.items())]
+        values = self.collect()
+        helps = dict(connections='Открытых соединений',
+                     outbox_bytes='Байт в исходящих очередях',
+                     outbox_max_bytes='Самая длинная исходящая очередь, байт')
+        helps.update({name: help for name, (help, _) in list(self.gauges.items())})
+        for name, value in values.items():
+            if name == 'broadcast_bytes':
+                continue
+            lines += [f'# HELP pixel_{name} {helps[name]}',
+                      f'# TYPE pixel_{name} gauge',
+                      f'pixel_{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def write_histogram(lines, name, help, series):
+    lines += [f'# HELP {name} {help}', f'# TYPE {name} histogram']
+    for labels, histogram in series:
+        prefix = labels + ',' if labels else ''
+        for bound, total in histogram.cumulative():
+            lines.append(f'{name}_bucket{{{prefix}le="{format_bound(bound)}"}} {total}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {histogram.sum}')
+        lines.append(f'{name}_count{suffix} {histogram.count}')
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = self.server.metrics.render().encode()
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/metrics.json':
+            body = json.dumps(self.server.metrics.to_dict()).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(metrics, host, port):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def dump_periodically(metrics, path, interval=DUMP_INTERVAL):
+    def run():
+        while True:
+            time.sleep(interval)
+            temporary = path + '.tmp'
+            try:
+                with open(temporary, 'w') as file:
+                    json.dump(metrics.to_dict(), file)
+                os.replace(temporary, path)
+            except OSError as error:
+                print(f'Ошибка записи метрик {path}: {error}')
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+default = Metrics()
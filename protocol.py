@@ -0,0 +1,218 @@
+import struct
+import zlib
+
+import codec
+from canvas import Canvas
+
+HEADER = struct.Struct('!I')
+PIXEL = struct.Struct('!BIHHBBB')
+PIXEL_FRAME = struct.Struct('!IBIHHBBB')
+CANVAS = struct.Struct('!BHHI')
+CHUNK = struct.Struct('!BHHHH')
+DELTA = struct.Struct('!BI')
+MOVE = struct.Struct('!IHHBBB')
+NACK = struct.Struct('!BHHH')
+NACK_FRAME = struct.Struct('!IBHHH')
+REPLAY_MOVE = struct.Struct('!IHHI')
+PIXEL_TAG = 0x01
+CANVAS_TAG = 0x02
+CHUNK_TAG = 0x03
+DELTA_TAG = 0x04
+NACK_TAG = 0x05
+REPLAY_TAG = 0x06
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+CLIENT_FRAME_SIZE = 16 * 1024
+MAX_CANVAS_PIXELS = 4096 * 4096
+RECV_SIZE = 64 * 1024
+CODECS = {schema.version: schema for schema in codec.CODECS}
+CODEC_TAGS = {schema.tag: schema for schema in codec.CODECS}
+CODEC_VERSION = max(CODECS)
+BASE_CODEC_VERSION = min(CODECS)
+CLIENT_TAGS = frozenset((PIXEL_TAG, *CODEC_TAGS))
+CLIENT_MESSAGES = frozenset(('hello', 'name', 'room', 'color', 'new_player', 'ready', 'exit',
+                             'viewport', 'sync', 'chat', 'exit_color_window', 'replays',
+                             'replay'))
+
+
+class FrameError(ValueError):
+    pass
+
+
+def color_to_rgb(color):
+    return int(color.lstrip('#'), 16)
+
+
+def rgb_to_color(rgb):
+    return f'#{rgb:06x}'
+
+
+def encode_pixel(x, y, rgb, version=0):
+    return PIXEL_FRAME.pack(PIXEL.size, PIXEL_TAG, version, x, y,
+                            rgb >> 16, (rgb >> 8) & 0xff, rgb & 0xff)
+
+
+def decode_pixel(buffer, offset=0):
+    _, version, x, y, r, g, b = PIXEL.unpack_from(buffer, offset)
+    return dict(data=(x, y, (r << 16) | (g << 8) | b), msgtype='game', version=version)
+
+
+def encode_canvas(canvas, version=0):
+    pixels = zlib.compress(canvas.snapshot(), 1)
+    return b''.join((HEADER.pack(CANVAS.size + len(pixels)),
+                     CANVAS.pack(CANVAS_TAG, canvas.width, canvas.height, version),
+                     pixels))
+
+
+def decode_canvas(buffer, offset, end):
+    _, width, height, version = CANVAS.unpack_from(buffer, offset)
+    if width * height > MAX_CANVAS_PIXELS:
+        raise FrameError(f'canvas {width}x{height} is too large')
+    pixels = zlib.decompressobj().decompress(buffer[offset + CANVAS.size:end], width * height * 4)
+    if len(pixels) != width * height * 4:
+        raise FrameError('malformed canvas frame')
+    canvas = Canvas.from_bytes(width, height, pixels)
+    return dict(data=canvas, msgtype='continue_game', version=version)
+
+
+def encode_delta(moves):
+    body = b''.join(MOVE.pack(version, x, y, rgb >> 16, (rgb >> 8) & 0xff, rgb & 0xff)
+                    for version, x, y, rgb in moves)
+    return b''.join((HEADER.pack(DELTA.size + len(body)),
+                     DELTA.pack(DELTA_TAG, len(moves)),
+                     body))
+
+
+def decode_delta(buffer, offset, end):
+    _, count = DELTA.unpack_from(buffer, offset)
+    if end - offset - DELTA.size != count * MOVE.size:
+        raise FrameError('malformed delta frame')
+    packets = []
+    for version, x, y, r, g, b in MOVE.iter_unpack(buffer[offset + DELTA.size:end]):
+        packets.append(dict(data=(x, y, (r << 16) | (g << 8) | b), msgtype='game', version=version))
+    return packets
+
+
+def encode_chunk(x, y, width, height, pixels):
+    return b''.join((HEADER.pack(CHUNK.size + len(pixels)),
+                     CHUNK.pack(CHUNK_TAG, x, y, width, height),
+                     pixels))
+
+
+def decode_chunk(buffer, offset, end):
+    _, x, y, width, height = CHUNK.unpack_from(buffer, offset)
+    if end - offset - CHUNK.size != width * height * 4:
+        raise FrameError('malformed chunk frame')
+    pixels = bytes(buffer[offset + CHUNK.size:end])
+    return dict(data=(x, y, width, height, pixels), msgtype='chunk')
+
+
+def encode_nack(x, y, retry_ms):
+    return NACK_FRAME.pack(NACK.size, NACK_TAG, x, y, min(retry_ms, 0xffff))
+
+
+def decode_nack(buffer, offset=0):
+    _, x, y, retry_ms = NACK.unpack_from(buffer, offset)
+    return dict(data=(x, y, retry_ms), msgtype='nack')
+
+
+def encode_replay(moves):
+    return b''.join((HEADER.pack(1 + len(moves)), bytes((REPLAY_TAG,)), moves))
+
+
+def decode_replay(buffer, offset, end):
+    if (end - offset - 1) % REPLAY_MOVE.size:
+        raise FrameError('malformed replay frame')
+    return dict(data=list(REPLAY_MOVE.iter_unpack(buffer[offset + 1:end])), msgtype='replay')
+
+
+def negotiate(offered):
+    common = set(CODECS).intersection(offered) if isinstance(offered, list) else ()
+    return max(common, default=None)
+
+
+def hello(versions=None):
+    return encode(dict(data=sorted(CODECS) if versions is None else versions,
+                       msgtype='hello'),
+                  BASE_CODEC_VERSION)
+
+
+def encode(packet, version=CODEC_VERSION):
+    if packet['msgtype'] == 'game':
+        return encode_pixel(*packet['data'], packet.get('version', 0))
+    if packet['msgtype'] == 'continue_game':
+        return encode_canvas(packet['data'], packet.get('version', 0))
+    if packet['msgtype'] == 'delta':
+        return encode_delta(packet['data'])
+    if packet['msgtype'] == 'chunk':
+        return encode_chunk(*packet['data'])
+    if packet['msgtype'] == 'nack':
+        return encode_nack(*packet['data'])
+    body = CODECS[version].encode(packet)
+    return HEADER.pack(len(body)) + body
+
+
+def encode_many(packets, version=CODEC_VERSION):
+    return b''.join(encode(packet, version) for packet in packets)
+
+
+class FrameDecoder:
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE, tags=None, msgtypes=None):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+        self.tags = tags
+        self.msgtypes = msgtypes
+
+    def feed(self, data):
+        self.buffer += data
+        packets = []
+        offset = 0
+        with memoryview(self.buffer) as view:
+            while len(view) - offset >= HEADER.size:
+                (size,) = HEADER.unpack_from(view, offset)
+                if size > self.max_frame_size:
+                    raise FrameError(f'frame of {size} bytes exceeds limit')
+                end = offset + HEADER.size + size
+                if end > len(view):
+                    break
+                start = offset + HEADER.size
+                tag = view[start] if size else None
+                if self.tags is not None and tag not in self.tags:
+                    raise FrameError(f'unexpected frame tag {tag}')
+                try:
+                    self.decode(view, tag, start, end, packets)
+                except FrameError:
+                    raise
+                except (ValueError, IndexError, struct.error, zlib.error) as error:
+                    raise FrameError(f'malformed frame: {error}')
+                offset = end
+        del self.buffer[:offset]
+        return packets
+
+    def decode(self, view, tag, start, end, packets):
+        if tag == PIXEL_TAG:
+            fixed_size(PIXEL, start, end)
+            packets.append(decode_pixel(view, start))
+        elif tag == CANVAS_TAG:
+            packets.append(decode_canvas(view, start, end))
+        elif tag == CHUNK_TAG:
+            packets.append(decode_chunk(view, start, end))
+        elif tag == DELTA_TAG:
+            packets.extend(decode_delta(view, start, end))
+        elif tag == NACK_TAG:
+            fixed_size(NACK, start, end)
+            packets.append(decode_nack(view, start))
+        elif tag == REPLAY_TAG:
+            packets.append(decode_replay(view, start, end))
+        elif tag in CODEC_TAGS:
+            packets.append(CODEC_TAGS[tag].decode(bytes(view[start:end]), self.msgtypes))
+        else:
+            raise FrameError(f'unknown frame tag {tag}')
+
+
+def fixed_size(layout, start, end):
+    if end - start != layout.size:
+        raise FrameError(f'frame of {end - start} bytes, expected {layout.size}')
+
+
+def client_decoder():
+    return FrameDecoder(CLIENT_FRAME_SIZE, CLIENT_TAGS, CLIENT_MESSAGES)
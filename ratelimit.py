@@ -0,0 +1,60 @@
+import time
+
+PLAYER_PIXEL_RATE = 10.0
+PLAYER_PIXEL_BURST = 20
+ROOM_PIXEL_RATE = 200.0
+ROOM_PIXEL_BURST = 400
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now=None):
+        self.refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def give_back(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def retry_after(self):
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class RateLimits:
+    def __init__(self, player_rate=PLAYER_PIXEL_RATE, player_burst=PLAYER_PIXEL_BURST,
+                 room_rate=ROOM_PIXEL_RATE, room_burst=ROOM_PIXEL_BURST):
+        self.player_rate = player_rate
+        self.player_burst = player_burst
+        self.room_rate = room_rate
+        self.room_burst = room_burst
+
+    def player_bucket(self):
+        return TokenBucket(self.player_rate, self.player_burst) if self.player_rate else None
+
+    def room_bucket(self):
+        return TokenBucket(self.room_rate, self.room_burst) if self.room_rate else None
+
+
+def add_arguments(parser):
+    parser.add_argument('--pixel-rate', type=float, default=PLAYER_PIXEL_RATE,
+                        help='пикселей в секунду на игрока, 0 - без ограничения')
+    parser.add_argument('--pixel-burst', type=int, default=PLAYER_PIXEL_BURST)
+    parser.add_argument('--room-pixel-rate', type=float, default=ROOM_PIXEL_RATE,
+                        help='пикселей в секунду на комнату, 0 - без ограничения')
+    parser.add_argument('--room-pixel-burst', type=int, default=ROOM_PIXEL_BURST)
+
+
+def from_arguments(args):
+    return RateLimits(args.pixel_rate, args.pixel_burst,
+                      args.room_pixel_rate, args.room_pixel_burst)
@@ -0,0 +1,148 @@
+import argparse
+import os
+import struct
+import time
+
+import export
+import protocol
+from canvas import Canvas
+
+HEADER = struct.Struct('!4sHHdI')
+MOVE = protocol.REPLAY_MOVE
+MAGIC = b'PXR1'
+REPLAY_TICK = 0.05
+REPLAY_ROUNDS = 5
+MAX_SPEED = 1000
+
+
+class RoundRecorder:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.started = time.time()
+        self.origin = time.monotonic()
+        self.moves = bytearray()
+
+    def record(self, x, y, rgb):
+        elapsed = int((time.monotonic() - self.origin) * 1000)
+        self.moves += MOVE.pack(elapsed, x, y, rgb)
+
+    def finish(self):
+        return Recording(self.width, self.height, self.started, bytes(self.moves))
+
+
+class Recording:
+    def __init__(self, width, height, started, moves):
+        self.width = width
+        self.height = height
+        self.started = started
+        self.data = moves
+
+    def __len__(self):
+        return len(self.data) // MOVE.size
+
+    @property
+    def duration(self):
+        return MOVE.unpack_from(self.data, len(self.data) - MOVE.size)[0] if self.data else 0
+
+    def moves(self):
+        return MOVE.iter_unpack(self.data)
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, self.width, self.height, self.started, len(self)))
+            file.write(self.data)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            data = file.read()
+        magic, width, height, started, count = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a replay file')
+        moves = data[HEADER.size:HEADER.size + count * MOVE.size]
+        return cls(width, height, started, moves[:len(moves) - len(moves) % MOVE.size])
+
+    def frames(self, fps=10, speed=1.0):
+        if fps <= 0 or speed <= 0:
+            raise ValueError('fps and speed must be positive')
+        canvas = Canvas(self.width, self.height)
+        step = 1000 * speed / fps
+        frame_end = 0.0
+        for elapsed, x, y, rgb in self.moves():
+            while elapsed > frame_end:
+                yield canvas
+                frame_end += step
+            canvas.set(x, y, rgb)
+        yield canvas
+
+    def render(self, directory, fps=10, speed=1.0, scale=1):
+        os.makedirs(directory, exist_ok=True)
+        count = 0
+        for count, canvas in enumerate(self.frames(fps, speed), 1):
+            export.save_png(os.path.join(directory, f'frame_{count:05d}.png'), canvas, scale)
+        return count
+
+
+class ReplayStream:
+    def __init__(self, room, client, recording, speed, scheduler):
+        self.room = room
+        self.client = client
+        self.recording = recording
+        self.speed = max(0.1, min(float(speed), MAX_SPEED))
+        self.scheduler = scheduler
+        self.offset = 0
+        self.origin = 0.0
+
+    def start(self):
+        self.origin = time.monotonic()
+        self.client.send_packet(dict(data=dict(width=self.recording.width,
+                                               height=self.recording.height,
+                                               started=self.recording.started,
+                                               moves=len(self.recording)),
+                                     msgtype='replay_start'))
+        self.tick()
+
+    def tick(self):
+        with self.room.lock:
+            if self.client not in self.room.clients:
+                return
+            if self.room.is_active:
+                self.finish()
+                return
+            data = self.recording.data
+            until = (time.monotonic() - self.origin) * 1000 * self.speed
+            end = self.offset
+            while end < len(data) and MOVE.unpack_from(data, end)[0] <= until:
+                end += MOVE.size
+            if end > self.offset:
+                self.client.send(protocol.encode_replay(data[self.offset:end]))
+                self.offset = end
+            if self.offset < len(data):
+                self.scheduler.call_later(REPLAY_TICK, self.tick)
+            else:
+                self.finish()
+
+    def finish(self):
+        self.client.send_packet(dict(data='',
+                                     msgtype='replay_end'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('--out', default='frames')
+    parser.add_argument('--fps', type=float, default=10)
+    parser.add_argument('--speed', type=float, default=10)
+    parser.add_argument('--scale', type=int, default=8)
+    args = parser.parse_args()
+    if args.fps <= 0 or args.speed <= 0:
+        parser.error('--fps и --speed должны быть больше нуля')
+
+    recording = Recording.load(args.path)
+    count = recording.render(args.out, args.fps, args.speed, args.scale)
+    print(f'Сохранено {count} кадров в {args.out}')
+
+
+if __name__ == "__main__":
+    main()
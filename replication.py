@@ -0,0 +1,235 @@
+import argparse
+import random
+import socket
+import threading
+import traceback
+from array import array
+from collections import defaultdict
+from queue import Queue, Empty
+
+import protocol
+
+NODE_BITS = 16
+NODE_MASK = (1 << NODE_BITS) - 1
+
+
+class Backend:
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def subscribe(self, channel, callback):
+        raise NotImplementedError
+
+    def unsubscribe(self, channel, callback):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def dispatch(self, channel, message):
+        for callback in list(self.callbacks.get(channel, ())):
+            try:
+                callback(message)
+            except Exception:
+                print(f'Ошибка в обработчике канала {channel}:')
+                traceback.print_exc()
+
+
+class LocalBackend(Backend):
+    def __init__(self):
+        self.callbacks = defaultdict(list)
+        self.queue = Queue()
+
+        threading.Thread(target=self.deliver, daemon=True).start()
+
+    def publish(self, channel, message):
+        self.queue.put((channel, message))
+
+    def deliver(self):
+        while True:
+            channel, message = self.queue.get()
+            self.dispatch(channel, message)
+
+    def subscribe(self, channel, callback):
+        self.callbacks[channel].append(callback)
+
+    def unsubscribe(self, channel, callback):
+        self.callbacks[channel].remove(callback)
+        if not self.callbacks[channel]:
+            del self.callbacks[channel]
+
+
+class BrokerBackend(Backend):
+    def __init__(self, host, port):
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.callbacks = defaultdict(list)
+        self.outbox = Queue()
+        self.closed = False
+
+        threading.Thread(target=self.receive, daemon=True).start()
+        threading.Thread(target=self.flush, daemon=True).start()
+
+    def send(self, packet):
+        self.outbox.put(protocol.encode(packet))
+
+    def flush(self):
+        while True:
+            frames = [self.outbox.get()]
+            try:
+                while True:
+                    frames.append(self.outbox.get_nowait())
+            except Empty:
+                pass
+            try:
+                self.socket.sendall(b''.join(frames))
+            except OSError:
+                return
+
+    def publish(self, channel, message):
+        self.send(dict(data=(channel, message), msgtype='publish'))
+
+    def subscribe(self, channel, callback):
+        self.callbacks[channel].append(callback)
+        self.send(dict(data=channel, msgtype='subscribe'))
+
+    def unsubscribe(self, channel, callback):
+        self.callbacks[channel].remove(callback)
+        if not self.callbacks[channel]:
+            del self.callbacks[channel]
+            self.send(dict(data=channel, msgtype='unsubscribe'))
+
+    def receive(self):
+        decoder = protocol.FrameDecoder()
+        while True:
+            try:
+                data_in_bytes = self.socket.recv(protocol.RECV_SIZE)
+            except OSError:
+                break
+            if not data_in_bytes:
+                break
+            try:
+                packets = decoder.feed(data_in_bytes)
+            except protocol.FrameError as error:
+                print(f'Повреждённый кадр от брокера: {error}')
+                break
+            for packet in packets:
+                if packet['msgtype'] == 'publish':
+                    self.dispatch(*packet['data'])
+        if not self.closed:
+            print('Соединение с брокером потеряно, репликация остановлена.')
+
+    def close(self):
+        self.closed = True
+        self.socket.close()
+
+
+class Broker:
+    def __init__(self, host, port):
+        self.socket = socket.create_server((host, port))
+        self.subscribers = defaultdict(set)
+        self.send_locks = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        print("Брокер ожидает подключение серверов...")
+        while True:
+            peer, _ = self.socket.accept()
+            peer.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.send_locks[peer] = threading.Lock()
+            threading.Thread(target=self.serve_peer, args=(peer,), daemon=True).start()
+
+    def serve_peer(self, peer):
+        decoder = protocol.FrameDecoder()
+        try:
+            while True:
+                data_in_bytes = peer.recv(protocol.RECV_SIZE)
+                if not data_in_bytes:
+                    break
+                for packet in decoder.feed(data_in_bytes):
+                    match packet['msgtype']:
+                        case 'subscribe':
+                            with self.lock:
+                                self.subscribers[packet['data']].add(peer)
+                        case 'unsubscribe':
+                            with self.lock:
+                                self.subscribers[packet['data']].discard(peer)
+                                if not self.subscribers[packet['data']]:
+                                    del self.subscribers[packet['data']]
+                        case 'publish':
+                            self.forward(peer, packet)
+        except (ConnectionError, OSError, protocol.FrameError):
+            pass
+        with self.lock:
+            for peers in self.subscribers.values():
+                peers.discard(peer)
+        self.send_locks.pop(peer, None)
+        peer.close()
+
+    def forward(self, sender, packet):
+        frame = protocol.encode(packet)
+        with self.lock:
+            peers = [peer for peer in self.subscribers.get(packet['data'][0], ())
+                     if peer is not sender]
+        for peer in peers:
+            try:
+                with self.send_locks[peer]:
+                    peer.sendall(frame)
+            except (KeyError, OSError):
+                pass
+
+
+def node_of(stamp):
+    return stamp & NODE_MASK
+
+
+class Replicator:
+    def __init__(self, backend, node_id=None):
+        self.backend = backend
+        self.node_id = node_id if node_id is not None else random.getrandbits(NODE_BITS)
+        self.clock = 0
+        self.callbacks = {}
+        self.lock = threading.Lock()
+
+    def stamp(self):
+        with self.lock:
+            self.clock += 1
+            return (self.clock << NODE_BITS) | self.node_id
+
+    def observe(self, stamp):
+        with self.lock:
+            self.clock = max(self.clock, stamp >> NODE_BITS)
+
+    def attach(self, room):
+        room.replicator = self
+        room.stamps = array('Q', [0]) * len(room.game_state.pixels)
+        callback = self.callbacks[room] = lambda message: self.receive(room, message)
+        self.backend.subscribe(f'room:{room.name}', callback)
+        self.publish(room, 'state_request')
+
+    def detach(self, room):
+        callback = self.callbacks.pop(room, None)
+        if callback:
+            self.backend.unsubscribe(f'room:{room.name}', callback)
+        room.replicator = None
+
+    def publish(self, room, kind, *args):
+        self.backend.publish(f'room:{room.name}', (self.node_id, kind, args))
+
+    def receive(self, room, message):
+        node_id, kind, args = message
+        if node_id != self.node_id:
+            room.receive_replica(kind, args)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3436)
+    args = parser.parse_args()
+
+    Broker(args.host, args.port).start()
+
+
+if __name__ == "__main__":
+    main()
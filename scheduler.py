@@ -0,0 +1,87 @@
+import heapq
+import itertools
+import threading
+import time
+
+import metrics
+
+PENDING = 'pending'
+CANCELLED = 'cancelled'
+FIRED = 'fired'
+
+
+class Timer:
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.state = PENDING
+        self.handle = None
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        with self.lock:
+            if self.state != PENDING:
+                return False
+            self.state = CANCELLED
+        if self.handle:
+            self.handle.cancel()
+        return True
+
+    def run(self):
+        with self.lock:
+            if self.state != PENDING:
+                return
+            self.state = FIRED
+        metrics.default.observe_drift(time.monotonic() - self.deadline)
+        self.callback(*self.args)
+
+
+class Scheduler:
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def call_later(self, delay, callback, *args):
+        timer = Timer(time.monotonic() + delay, callback, args)
+        with self.condition:
+            heapq.heappush(self.heap, (timer.deadline, next(self.counter), timer))
+            if self.heap[0][2] is timer:
+                self.condition.notify()
+        return timer
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.condition.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                _, _, timer = heapq.heappop(self.heap)
+            try:
+                timer.run()
+            except Exception as error:
+                print(f'Ошибка таймера: {error}')
+
+
+class LoopScheduler:
+    def __init__(self, loop):
+        self.loop = loop
+
+    def call_later(self, delay, callback, *args):
+        timer = Timer(time.monotonic() + delay, callback, args)
+        timer.handle = self.loop.call_later(delay, timer.run)
+        return timer
+
+
+default = None
+default_lock = threading.Lock()
+
+
+def default_scheduler():
+    global default
+    with default_lock:
+        if default is None:
+            default = Scheduler()
+        return default
@@ -1,47 +1,530 @@
+import argparse
+import asyncio
+import functools
+import os
 import socket
 import threading
+from array import array
+from collections import deque
 from threading import Thread
-import pickle
 import time
 
+import export
+import metrics
+import protocol
+import ratelimit
+import replay
+import replication
+import storage
+from canvas import Canvas, from_wire
+from scheduler import LoopScheduler, default_scheduler
+
+BACKLOG = 1024
+OUTBOX_LIMIT = 1024 * 1024
+CLOSE_TIMEOUT = 5.0
+MOVE_LOG_SIZE = 10000
+ROOM_NAMES = ('Room1', 'Room2', 'Room3')
+MAX_ROOMS = 50000
+ROOM_CAPACITY = 16
+ROOM_IDLE_TIMEOUT = 60.0
+MAX_ROOM_NAME = 32
+ROUND_DURATION = 60
+
+class FanoutStats:
+    def __init__(self):
+        self.broadcasts = 0
+        self.bytes = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, size, elapsed, recipients=0):
+        self.broadcasts += 1
+        self.bytes += size
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        metrics.default.observe_broadcast(recipients, size, elapsed)
+
+    def to_dict(self):
+        return dict(broadcasts=self.broadcasts, bytes=self.bytes,
+                    total_seconds=self.total_time, max_seconds=self.max_time)
+
+def locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class RoomRegistry:
+    def __init__(self, room_factory, max_rooms=MAX_ROOMS, capacity=ROOM_CAPACITY,
+                 idle_timeout=ROOM_IDLE_TIMEOUT, permanent=ROOM_NAMES):
+        self.room_factory = room_factory
+        self.max_rooms = max_rooms
+        self.capacity = capacity
+        self.idle_timeout = idle_timeout
+        self.permanent = set(permanent)
+        self.rooms = {}
+        self.free = {}
+        self.active = set()
+        self.idle = {}
+        self.lock = threading.RLock()
+
+        for name in permanent:
+            self.open(name)
+
+    def __iter__(self):
+        return iter(list(self.rooms.values()))
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def get(self, name):
+        return self.rooms.get(name)
+
+    def open(self, name):
+        with self.lock:
+            self.reap()
+            room = self.rooms.get(name)
+            if room is None and len(self.rooms) < self.max_rooms and valid_room_name(name):
+                room = self.room_factory(name)
+                room.registry = self
+                self.rooms[name] = room
+                self.update(room)
+            return room
+
+    def has_place(self, room):
+        return len(room.clients) < self.capacity
+
+    def update(self, room):
+        with self.lock:
+            name = room.name
+            if self.rooms.get(name) is not room:
+                return
+            if room.is_active:
+                self.active.add(name)
+            else:
+                self.active.discard(name)
+            if not room.is_active and self.has_place(room):
+                self.free[name] = room
+            else:
+                self.free.pop(name, None)
+            if room.clients or room.is_active:
+                self.idle.pop(name, None)
+            elif name not in self.idle and name not in self.permanent:
+                self.idle[name] = time.monotonic()
+
+    def free_rooms(self):
+        with self.lock:
+            self.reap()
+            return list(self.free)
+
+    def reap(self):
+        with self.lock:
+            deadline = time.monotonic() - self.idle_timeout
+            while self.idle:
+                name, since = next(iter(self.idle.items()))
+                if since > deadline:
+                    break
+                del self.idle[name]
+                room = self.rooms[name]
+                if not room.lock.acquire(blocking=False):
+                    self.idle[name] = time.monotonic()
+                    continue
+                try:
+                    if room.clients or room.is_active:
+                        continue
+                    room.closed = True
+                finally:
+                    room.lock.release()
+                self.free.pop(name, None)
+                del self.rooms[name]
+                room.close()
+
+def watch_rooms(rooms):
+    metrics.default.gauge('rooms', 'Открытых комнат', rooms.__len__)
+    metrics.default.gauge('active_rooms', 'Комнат с идущим раундом', lambda: len(rooms.active))
+    metrics.default.gauge('players', 'Игроков в комнатах',
+                          lambda: sum(len(room.clients) for room in rooms))
+    metrics.default.section('fanout', lambda: {room.name: room.fanout_stats.to_dict()
+                                               for room in rooms if room.fanout_stats.broadcasts})
+
+def last_version(value):
+    if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return value
+    return None
+
+def valid_room_name(name):
+    return isinstance(name, str) and 0 < len(name.strip()) == len(name) <= MAX_ROOM_NAME
+
+def room_not_free(rooms):
+    return dict(data=dict(message='Комната недоступна',
+                          rooms=rooms),
+                msgtype='room_not_free')
+
 class GameRoom:
-    def __init__(self, name):
+    def __init__(self, name, width=25, height=25, archive_dir=None, limits=None,
+                 tick_interval=None):
         self.is_active: bool = False
         self.name: str = name
         self.clients: list = []
-        self.ready_clients_count = 0
+        self.ready_clients = set()
         self.clients_names: list = []
-        self.colors = []
+        self.colors = {}
+        self.lock = threading.RLock()
+        self.closed = False
         self.game_timer = None
-        self.timer_is_active = False
+        self.scheduler = None
+        self.deadline = 0.0
+        self.ends_at = 0.0
+        self.fanout_stats = FanoutStats()
+        self.limits = limits or ratelimit.RateLimits()
+        self.buckets = {}
+        self.room_bucket = self.limits.room_bucket()
+        self.tick_interval = tick_interval
+        self.dirty = {}
+        self.flush_timer = None
+
+        self.game_state = Canvas(width, height)
+        self.viewports = {}
+        self.archive_dir = archive_dir
+        self.version = 0
+        self.base_version = 0
+        self.move_log = deque(maxlen=MOVE_LOG_SIZE)
+        self.replicator = None
+        self.stamps = None
+        self.registry = None
+        self.store = None
+        self.recorder = None
+        self.recordings = deque(maxlen=replay.REPLAY_ROUNDS)
+        self.round_stamp = 0
+        self.remote_rounds = {}
+
+    def changed(self):
+        if self.registry:
+            self.registry.update(self)
+
+    def close(self):
+        if self.replicator:
+            self.replicator.detach(self)
+        if self.store:
+            self.store.close()
+
+    @locked
+    def attach_store(self, store):
+        self.store = store
+        self.version = store.load(self.game_state)
+        self.reset_history()
+
+    def persist_snapshot(self):
+        if self.store:
+            self.store.compact(self.version, self.game_state)
+
+    @locked
+    def add_client(self, client, client_name):
+        if self.closed or (self.registry and not self.registry.has_place(self)):
+            return False
+        self.clients.append(client)
+        self.clients_names.append(client_name)
+        self.changed()
+        return True
 
-        self.game_state = {}
+    @locked
+    def color_taken(self, color):
+        return color in self.colors.values()
 
-    def broadcast(self, packet, except_client=None):
+    @locked
+    def add_player(self, client, client_name, color):
+        if client not in self.clients:
+            return
+        self.colors[client] = color
+        self.broadcast(dict(data=f'Игрок {client_name} присоединился к комнате.\n',
+                            msgtype='chat'),
+                       client)
+
+    @locked
+    def set_ready(self, client, client_name, last_version=None):
+        if client not in self.clients:
+            return
+        self.broadcast(dict(data=f'Игрок {client_name} готов к игре.\n',
+                            msgtype='chat'))
+        self.ready_clients.add(client)
+        if not self.is_active:
+            if len(self.ready_clients) == len(self.clients) and len(self.ready_clients) > 1:
+                self.start_game(client)
+                self.is_active = True
+                self.changed()
+        else:
+            self.start_game(client, last_version)
+
+    def broadcast(self, packet, except_client=None, chunk=None):
+        started = time.perf_counter()
+        frames = {}
+        sent = 0
+        recipients = 0
         for client in self.clients:
-            if client != except_client:
-                client.send(pickle.dumps(packet))
+            if client != except_client and self.sees(client, chunk):
+                version = client.codec_version
+                frame = frames.get(version)
+                if frame is None:
+                    frame = frames[version] = protocol.encode(packet, version)
+                client.send(frame)
+                sent += len(frame)
+                recipients += 1
+        self.fanout_stats.record(sent, time.perf_counter() - started, recipients)
+
+    def sees(self, client, chunk):
+        if chunk is None:
+            return True
+        chunks = self.viewports.get(client)
+        return chunks is None or chunk in chunks
+
+    @locked
+    def place_pixel(self, packet, client=None):
+        x, y, rgb = packet['data']
+        if not self.game_state.contains(x, y):
+            return
+        if client is not None and not self.admit(client, x, y):
+            return
+        stamp = self.replicator.stamp() if self.replicator else 0
+        self.write_pixel(x, y, rgb, stamp)
+        self.publish('pixel', x, y, rgb, stamp)
+
+    def admit(self, client, x, y):
+        now = time.monotonic()
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            bucket = self.buckets[client] = self.limits.player_bucket()
+        if bucket and not bucket.take(now):
+            self.reject(client, x, y, bucket)
+            return False
+        if self.room_bucket and not self.room_bucket.take(now):
+            if bucket:
+                bucket.give_back()
+            self.reject(client, x, y, self.room_bucket, by_room=True)
+            return False
+        metrics.default.observe_pixel('accepted')
+        return True
+
+    def reject(self, client, x, y, bucket, by_room=False):
+        metrics.default.observe_pixel('room_throttled' if by_room else 'player_throttled')
+        client.send(protocol.encode_nack(x, y, int(bucket.retry_after() * 1000) + 1))
 
-    def start_game(self, client):
+    def write_pixel(self, x, y, rgb, stamp=0):
+        if self.stamps is not None:
+            index = y * self.game_state.width + x
+            if stamp < self.stamps[index]:
+                return
+            self.stamps[index] = stamp
+        self.game_state.set(x, y, rgb)
+        self.version += 1
+        self.move_log.append((self.version, x, y, rgb))
+        if self.recorder:
+            self.recorder.record(x, y, rgb)
+        if self.store:
+            self.store.append_pixel(self.version, x, y, rgb)
+            if self.store.needs_compaction():
+                self.persist_snapshot()
+        if self.tick_interval:
+            self.mark_dirty(x, y, rgb)
+        else:
+            self.broadcast(dict(data=(x, y, rgb), msgtype='game', version=self.version),
+                           chunk=self.game_state.chunk_of(x, y))
+
+    def mark_dirty(self, x, y, rgb):
+        self.dirty[(x, y)] = (self.version, x, y, rgb)
+        if self.flush_timer is None:
+            scheduler = self.scheduler or default_scheduler()
+            self.flush_timer = scheduler.call_later(self.tick_interval, self.flush_dirty)
+
+    @locked
+    def flush_dirty(self):
+        moves = list(self.dirty.values())
+        self.dirty.clear()
+        timer, self.flush_timer = self.flush_timer, None
+        if timer:
+            timer.cancel()
+        if moves:
+            self.broadcast_moves(moves)
+
+    def broadcast_moves(self, moves):
+        started = time.perf_counter()
+        chunk_of = self.game_state.chunk_of
+        frame = protocol.encode_delta(moves)
+        dirty_chunks = {chunk_of(x, y) for _, x, y, _ in moves}
+        sent = 0
+        recipients = 0
+        for client in self.clients:
+            chunks = self.viewports.get(client)
+            if chunks is None or dirty_chunks <= chunks:
+                client.send(frame)
+                sent += len(frame)
+                recipients += 1
+                continue
+            visible = [move for move in moves if chunk_of(move[1], move[2]) in chunks]
+            if visible:
+                data = protocol.encode_delta(visible)
+                client.send(data)
+                sent += len(data)
+                recipients += 1
+        self.fanout_stats.record(sent, time.perf_counter() - started, recipients)
+
+    def publish(self, kind, *args):
+        if self.replicator:
+            self.replicator.publish(self, kind, *args)
+
+    @locked
+    def receive_replica(self, kind, args):
+        match kind:
+            case 'pixel':
+                x, y, rgb, stamp = args
+                self.replicator.observe(stamp)
+                if self.game_state.contains(x, y):
+                    self.write_pixel(x, y, rgb, stamp)
+
+            case 'chat':
+                self.broadcast(dict(data=args[0],
+                                    msgtype='chat'))
+
+            case 'round':
+                self.replicator.observe(args[0])
+                self.remote_rounds[replication.node_of(args[0])] = (args[0], time.monotonic())
+
+            case 'clear':
+                self.replicator.observe(args[0])
+                self.remote_rounds.pop(replication.node_of(args[0]), None)
+                self.clear_before(self.protected_stamp(args[0]))
+                self.resync_clients()
+
+            case 'state_request':
+                if any(self.stamps):
+                    self.publish('state', bytes(self.game_state.snapshot()),
+                                 self.stamps.tobytes())
+
+            case 'state':
+                self.merge_state(*args)
+                self.resync_clients()
+
+    def protected_stamp(self, stamp):
+        deadline = time.monotonic() - ROUND_DURATION
+        floors = [started for started, since in self.remote_rounds.values() if since > deadline]
+        if self.is_active:
+            floors.append(self.round_stamp)
+        return min([stamp, *floors])
+
+    def clear_before(self, stamp):
+        self.flush_dirty()
+        pixels = self.game_state.pixels
+        stamps = self.stamps
+        for index, cell_stamp in enumerate(stamps):
+            if cell_stamp < stamp:
+                pixels[index] = 0
+                stamps[index] = stamp
+        self.reset_history()
+        self.persist_snapshot()
+
+    def merge_state(self, pixels, stamps):
+        self.flush_dirty()
+        remote_pixels = from_wire(pixels)
+        remote_stamps = array('Q')
+        remote_stamps.frombytes(stamps)
+        if len(remote_stamps) != len(self.stamps) or len(remote_pixels) != len(self.stamps):
+            return
+        for index, stamp in enumerate(remote_stamps):
+            if stamp > self.stamps[index]:
+                self.stamps[index] = stamp
+                self.game_state.pixels[index] = remote_pixels[index]
+        self.replicator.observe(max(remote_stamps))
+        self.reset_history()
+        self.persist_snapshot()
+
+    def reset_history(self):
+        self.move_log.clear()
+        self.base_version = self.version
+
+    def resync_clients(self):
+        if self.is_active:
+            for client in self.clients:
+                self.sync(client)
+
+    @locked
+    def set_viewport(self, client, x, y, width, height):
+        chunks = self.game_state.chunks_in(x, y, width, height)
+        previous = self.viewports.get(client, set())
+        self.viewports[client] = chunks
+        if self.is_active:
+            self.send_chunks(client, chunks - previous)
+
+    def send_chunks(self, client, chunks):
+        for cx, cy in chunks:
+            client.send_packet(dict(data=self.game_state.chunk(cx, cy),
+                                    msgtype='chunk'))
+
+    def can_resume_from(self, last_version):
+        if last_version is None or not self.base_version < last_version <= self.version:
+            return False
+        oldest = self.move_log[0][0] if self.move_log else self.version + 1
+        return oldest <= last_version + 1
+
+    @locked
+    def sync(self, client, last_version=None):
+        if self.can_resume_from(last_version):
+            moves = [move for move in list(self.move_log)
+                     if move[0] > last_version and
+                     self.sees(client, self.game_state.chunk_of(move[1], move[2]))]
+            client.send_packet(dict(data=moves,
+                                    msgtype='delta'))
+        elif client in self.viewports:
+            self.send_chunks(client, self.viewports[client])
+        else:
+            client.send_packet(dict(data=self.game_state,
+                                    msgtype='continue_game',
+                                    version=self.version))
+            return
+        client.send_packet(dict(data=self.version,
+                                msgtype='resume_game'))
+
+    @locked
+    def start_game(self, client, last_version=None):
         if self.game_timer:
-            client.send(pickle.dumps(dict(data=self.game_state,
-                                          msgtype='continue_game')))
+            self.sync(client, last_version)
+            client.send_packet(self.timer_packet())
 
         else:
             self.broadcast(dict(data="Игра началась! У вас есть 1 минута.\n",
                                 msgtype='start_game'))
-            self.timer_is_active = True
-            self.game_timer = threading.Thread(target=self.start_timer, args=(60,))
-            self.game_timer.start()
-
-    def start_timer(self, duration):
-        start_time = time.time()
-        while self.timer_is_active and time.time() - start_time < duration + 1:
-            update_time = duration - int(time.time() - start_time)
-            self.broadcast(dict(data=update_time,
-                                msgtype='update_timer'))
-            time.sleep(1)
+            for client in self.clients:
+                if any(self.game_state.pixels):
+                    self.sync(client)
+                else:
+                    client.send_packet(dict(data=self.version,
+                                            msgtype='resume_game'))
+            self.recorder = replay.RoundRecorder(self.game_state.width, self.game_state.height)
+            if self.replicator:
+                self.round_stamp = self.replicator.stamp()
+                self.publish('round', self.round_stamp)
+            self.game_timer = self.launch_timer(ROUND_DURATION)
 
+    def launch_timer(self, duration):
+        self.deadline = time.monotonic() + duration
+        self.ends_at = time.time() + duration
+        self.broadcast(self.timer_packet())
+        scheduler = self.scheduler or default_scheduler()
+        return scheduler.call_later(duration, self.finish_timer)
+
+    def timer_packet(self):
+        return dict(data=dict(ends_at=self.ends_at,
+                              remaining=max(0.0, self.deadline - time.monotonic())),
+                    msgtype='game_timer')
+
+    @locked
+    def stop_timer(self):
+        timer = self.game_timer
+        if timer and timer.cancel():
+            self.finish_timer()
+
+    @locked
+    def finish_timer(self):
+        self.flush_dirty()
         if len(self.clients) > 1:
             self.broadcast(dict(data="Время вышло.\n",
                                 msgtype='chat'))
@@ -49,53 +532,157 @@ class GameRoom:
                             msgtype="end_game"))
         self.end_game()
 
+    @locked
+    def chat(self, client, client_name, message):
+        if client not in self.clients:
+            return
+        self.broadcast(dict(data=f'{client_name}: {message}',
+                            msgtype='chat'),
+                       client)
+        client.send_packet(dict(data=f'You: {message}',
+                                msgtype='chat'))
+        self.publish('chat', f'{client_name}: {message}')
+
+    @locked
     def exit_color_window(self, client, client_name):
+        if client not in self.clients:
+            return
         client_idx = self.clients.index(client)
-        if len(self.colors) == len(self.clients):
-            self.colors.pop(client_idx)
+        self.colors.pop(client, None)
         self.clients.pop(client_idx)
         self.clients_names.pop(client_idx)
+        self.ready_clients.discard(client)
+        self.viewports.pop(client, None)
+        self.buckets.pop(client, None)
+        self.changed()
         self.broadcast(dict(data=f"Игрок {client_name} покинул комнату.\n",
                             msgtype='chat'),
                        client)
-        client.send(pickle.dumps(dict(data='',
-                                      msgtype='exit_color_window')))
+        client.send_packet(dict(data='',
+                                msgtype='exit_color_window'))
 
+    @locked
     def exit_room(self, client, client_name):
+        if client not in self.clients:
+            return
         client_idx = self.clients.index(client)
         self.clients.pop(client_idx)
         self.clients_names.pop(client_idx)
-        if self.ready_clients_count != 0:
-            self.ready_clients_count -= 1
-        self.colors.pop(client_idx)
+        self.viewports.pop(client, None)
+        self.buckets.pop(client, None)
+        self.ready_clients.discard(client)
+        self.colors.pop(client, None)
+        self.changed()
         self.broadcast(dict(data=f"Игрок {client_name} покинул игру.\n",
                             msgtype='chat'),
                        client)
-        client.send(pickle.dumps(dict(data='',
-                                      msgtype='exit_app')))
+        client.send_packet(dict(data='',
+                                msgtype='exit_app'))
         if len(self.clients) == 1:
-            self.timer_is_active = False
+            self.stop_timer()
+
+    @locked
+    def leave(self, client, client_name):
+        if client in self.colors:
+            self.exit_room(client, client_name)
+        else:
+            self.exit_color_window(client, client_name)
 
+    @locked
     def end_game(self):
-        self.broadcast(dict(data=60,
+        self.broadcast(dict(data=ROUND_DURATION,
                             msgtype='update_timer'))
         self.is_active = False
-        self.game_state = {}
-        self.timer_is_active = False
+        self.changed()
+        self.archive(self.finish_recording())
+        if self.replicator:
+            stamp = self.replicator.stamp()
+            self.clear_before(self.protected_stamp(stamp))
+            self.publish('clear', stamp)
+        else:
+            self.game_state.clear()
+            self.reset_history()
+            if self.store:
+                self.store.append_clear(self.version)
         self.game_timer = None
-        self.ready_clients_count = 0
+        self.ready_clients.clear()
+
+    def finish_recording(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is None:
+            return None
+        recording = recorder.finish()
+        if len(recording):
+            self.recordings.append(recording)
+        return recording
+
+    @locked
+    def start_replay(self, client, index=-1, speed=1.0):
+        if client not in self.clients:
+            return
+        if self.is_active:
+            message = 'Повтор доступен только между раундами.\n'
+        elif not isinstance(index, int) or not -len(self.recordings) <= index < len(self.recordings):
+            message = 'Запись раунда не найдена.\n'
+        else:
+            replay.ReplayStream(self, client, self.recordings[index], speed,
+                                self.scheduler or default_scheduler()).start()
+            return
+        client.send_packet(dict(data=message,
+                                msgtype='chat'))
+
+    @locked
+    def replay_list(self):
+        return [dict(started=recording.started, moves=len(recording),
+                     duration=recording.duration)
+                for recording in self.recordings]
+
+    @locked
+    def archive(self, recording=None):
+        if not self.archive_dir:
+            return
+        path = os.path.join(self.archive_dir, f'{self.name}-{time.strftime("%Y%m%d-%H%M%S")}')
+        if any(self.game_state.pixels):
+            threading.Thread(target=export.save_png,
+                             args=(path + '.png', self.game_state.copy())).start()
+        if recording:
+            threading.Thread(target=recording.save,
+                             args=(path + '.replay',)).start()
+
+class AsyncGameRoom(GameRoom):
+    loop = None
+
+    def receive_replica(self, kind, args):
+        self.loop.call_soon_threadsafe(super().receive_replica, kind, args)
 
 class GameServer:
-    def __init__(self, host, port):
+    def __init__(self, host, port, width=25, height=25, archive_dir=None,
+                 max_rooms=MAX_ROOMS, capacity=ROOM_CAPACITY, limits=None,
+                 tick_interval=None, data_dir=None):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.bind((host, port))
-        self.socket.listen(5)
+        self.socket.listen(BACKLOG)
         self.is_server_active: bool = True
-        self.rooms = [GameRoom('Room1'),
-                      GameRoom('Room2'),
-                      GameRoom('Room3')]
+        self.width = width
+        self.height = height
+        self.archive_dir = archive_dir
+        self.limits = limits
+        self.tick_interval = tick_interval
+        self.storage = storage.Storage(data_dir) if data_dir else None
+        self.replicator = None
+        self.rooms = RoomRegistry(self.create_room, max_rooms, capacity)
+        watch_rooms(self.rooms)
         self.package_template = {'data': '', 'msgtype': ''}
 
+    def create_room(self, name):
+        room = GameRoom(name, self.width, self.height, self.archive_dir, self.limits,
+                        self.tick_interval)
+        if self.storage:
+            room.attach_store(self.storage.open(name, self.width, self.height))
+        if self.replicator:
+            self.replicator.attach(room)
+        return room
+
     def start(self):
         print("Ожидание подключение игроков...")
         while self.is_server_active:
@@ -103,119 +690,360 @@ class GameServer:
             print(f'Подключен {client_address}')
             ClientHandler(client_socket, self.rooms)
 
-class ClientHandler(Thread):
+class AsyncGameServer:
+    permanent_rooms = ROOM_NAMES
+    idle_timeout = ROOM_IDLE_TIMEOUT
+
+    def __init__(self, host, port, width=25, height=25, archive_dir=None,
+                 max_rooms=MAX_ROOMS, capacity=ROOM_CAPACITY, limits=None,
+                 tick_interval=None, data_dir=None):
+        self.host = host
+        self.port = port
+        self.width = width
+        self.height = height
+        self.archive_dir = archive_dir
+        self.limits = limits
+        self.tick_interval = tick_interval
+        self.storage = storage.Storage(data_dir) if data_dir else None
+        self.replicator = None
+        self.loop = None
+        self.scheduler = None
+        self.rooms = RoomRegistry(self.create_room, max_rooms, capacity, self.idle_timeout,
+                                  self.permanent_rooms)
+        watch_rooms(self.rooms)
+
+    def create_room(self, name):
+        room = AsyncGameRoom(name, self.width, self.height, self.archive_dir, self.limits,
+                             self.tick_interval)
+        if self.storage:
+            room.attach_store(self.storage.open(name, self.width, self.height))
+        room.loop = self.loop
+        room.scheduler = self.scheduler
+        if self.replicator:
+            self.replicator.attach(room)
+        return room
+
+    def start(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.scheduler = LoopScheduler(self.loop)
+        for room in self.rooms:
+            room.loop = self.loop
+            room.scheduler = self.scheduler
+        server = await asyncio.start_server(self.handle_connection,
+                                            self.host, self.port,
+                                            backlog=BACKLOG)
+        print("Ожидание подключение игроков...")
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        print(f'Подключен {writer.get_extra_info("peername")}')
+        handler = AsyncClientHandler(StreamConnection(writer), self.rooms)
+        await handler.run(reader)
+
+class Connection:
+    codec_version = protocol.BASE_CODEC_VERSION
+
+    def send_packet(self, packet):
+        self.send(protocol.encode(packet, self.codec_version))
+
+class SocketConnection(Connection):
+    def __init__(self, client_socket, max_pending=OUTBOX_LIMIT):
+        self.socket = client_socket
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.pending_bytes = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        metrics.default.add_connection(self)
+
+        threading.Thread(target=self.flush, daemon=True).start()
+
+    def queued(self):
+        return self.pending_bytes
+
+    def send(self, data):
+        with self.condition:
+            if self.closed:
+                return
+            if self.pending_bytes + len(data) > self.max_pending:
+                print("Клиент не успевает принимать данные, соединение закрыто.")
+                self.pending.clear()
+                self.pending_bytes = 0
+                self.close()
+                self.shutdown()
+                return
+            self.pending.append(data)
+            self.pending_bytes += len(data)
+            self.condition.notify()
+
+    def flush(self):
+        closed = False
+        while not closed:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                closed = self.closed
+                chunks = list(self.pending)
+                self.pending.clear()
+                self.pending_bytes = 0
+            try:
+                if chunks:
+                    self.socket.sendall(b''.join(chunks))
+            except OSError:
+                self.close()
+                break
+        self.shutdown()
+
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        default_scheduler().call_later(CLOSE_TIMEOUT, self.shutdown)
+
+    def shutdown(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class StreamConnection(Connection):
+    def __init__(self, writer, max_pending=OUTBOX_LIMIT):
+        self.writer = writer
+        self.max_pending = max_pending
+        self.loop = asyncio.get_running_loop()
+        metrics.default.add_connection(self)
+
+    def queued(self):
+        transport = self.writer.transport
+        return 0 if transport.is_closing() else transport.get_write_buffer_size()
+
+    def send(self, data):
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self.write(data)
+        else:
+            self.loop.call_soon_threadsafe(self.write, data)
+
+    def write(self, data):
+        transport = self.writer.transport
+        if transport.is_closing():
+            return
+        if transport.get_write_buffer_size() + len(data) > self.max_pending:
+            print("Клиент не успевает принимать данные, соединение закрыто.")
+            transport.abort()
+            return
+        transport.write(data)
+
+    def close(self):
+        self.writer.close()
+
+class PlayerSession:
     def __init__(self, client, rooms):
-        super().__init__()
         self.client = client
         self.rooms = rooms
         self.room: GameRoom | None = None
         self.name: str = ''
         self.color: str = ''
 
-        self.start()
+    def disconnect(self):
+        if self.room:
+            self.room.leave(self.client, self.name)
+        self.client.close()
 
-    def run(self):
-        while True:
-            try:
-                data_in_bytes = self.client.recv(1024)
+    def dispatch(self, data):
+        started = time.perf_counter()
+        self.handle_packet(data)
+        metrics.default.observe_message(data['msgtype'], time.perf_counter() - started)
 
-                if not data_in_bytes:
-                    break
+    def handle_packet(self, data):
+        if self.room is None and data['msgtype'] not in ('hello', 'name', 'room'):
+            return
+        match data['msgtype']:
+            case 'hello':
+                version = protocol.negotiate(data['data'])
+                if version is None:
+                    self.client.send(protocol.hello([]))
+                    self.client.close()
+                    return
+                self.client.codec_version = version
+                self.client.send(protocol.hello([version]))
 
-                data = pickle.loads(data_in_bytes)
-
-                match data['msgtype']:
-                    case 'name':
-                        self.name = data['data']
-
-                        free_rooms = self.get_free_rooms()
-                        free_rooms_names = []
-                        for room in free_rooms:
-                            free_rooms_names.append(room.name)
-
-                        self.client.send(pickle.dumps(dict(data=free_rooms_names,
-                                                           msgtype='free_rooms')))
-
-                    case 'room':
-                        self.join_room(data['data'])
-
-                    case 'color':
-                        self.color = data['data']
-                        self.check_color(self.color)
-
-                    case 'new_player':
-                        self.room.colors.append(self.color)
-                        self.room.broadcast(dict(data=f'Игрок {self.name} присоединился к комнате.\n',
-                                                 msgtype='chat'),
-                                            self.client)
-
-                    case 'ready':
-                        self.room.broadcast(dict(data=f'Игрок {self.name} готов к игре.\n',
-                                                 msgtype='chat'))
-                        self.room.ready_clients_count += 1
-                        if not self.room.is_active:
-                            if (self.room.ready_clients_count == len(self.room.clients) and
-                                    self.room.ready_clients_count > 1):
-                                self.room.start_game(self.client)
-                                self.room.is_active = True
-                        else:
-                            self.room.start_game(self.client)
-
-                    case 'exit':
-                        self.room.exit_room(self.client, self.name)
-
-                    case 'game':
-                        x, y, color = tuple(data['data'].split())
-                        self.room.game_state[(int(x), int(y))] = color
-                        self.room.broadcast(dict(data='{}'.format(data['data']),
-                                                 msgtype='game'))
-
-                    case 'chat':
-                        message = data['data']
-                        self.room.broadcast(dict(data=f'{self.name}: {message}',
-                                                 msgtype='chat'),
-                                            self.client)
-                        self.client.send(pickle.dumps(dict(data=f'You: {message}',
-                                                           msgtype='chat')))
-
-                    case 'exit_color_window':
-                        self.room.exit_color_window(self.client, self.name)
-
-            except (ConnectionError, OSError):
-                print(f"Игрок {self.name} отключился.")
-                print(self.room.clients)
-                break
+            case 'name':
+                self.name = data['data']
+
+                self.client.send_packet(dict(data=self.rooms.free_rooms(),
+                                             msgtype='free_rooms'))
+
+            case 'room':
+                self.join_room(data['data'])
+
+            case 'color':
+                self.color = data['data']
+                self.check_color(self.color)
+
+            case 'new_player':
+                self.room.add_player(self.client, self.name, self.color)
+
+            case 'ready':
+                self.room.set_ready(self.client, self.name, last_version(data['data']))
+
+            case 'exit':
+                self.room.exit_room(self.client, self.name)
 
-    def get_free_rooms(self):
-        free_rooms = []
-        rooms = self.rooms
-        for room in rooms:
-            free_rooms.append(room)
+            case 'game':
+                self.room.place_pixel(data, self.client)
 
-        return free_rooms
+            case 'viewport':
+                self.room.set_viewport(self.client, *data['data'])
+
+            case 'sync':
+                if self.room.is_active:
+                    self.room.sync(self.client, last_version(data['data']))
+
+            case 'chat':
+                self.room.chat(self.client, self.name, data['data'])
+
+            case 'exit_color_window':
+                self.room.exit_color_window(self.client, self.name)
+
+            case 'replays':
+                self.client.send_packet(dict(data=self.room.replay_list(),
+                                             msgtype='replays'))
+
+            case 'replay':
+                index, speed = data['data']
+                self.room.start_replay(self.client, index, speed)
 
     def join_room(self, room_name):
-        for room in self.rooms:
-            if room.name == room_name:
-                print(f'Игрок {self.name} подключился к комнате')
-                self.room = room
-                room.clients.append(self.client)
-                room.clients_names.append(self.name)
-                break
+        if self.room:
+            self.room.leave(self.client, self.name)
+            self.room = None
+        if not self.enter_room(room_name):
+            self.client.send_packet(room_not_free(self.rooms.free_rooms()))
+
+    def enter_room(self, room_name):
+        room = self.rooms.open(room_name)
+        if room is None or not room.add_client(self.client, self.name):
+            return False
+        print(f'Игрок {self.name} подключился к комнате')
+        self.room = room
+        self.client.send_packet(dict(data=dict(width=room.game_state.width,
+                                               height=room.game_state.height),
+                                     msgtype='room_info'))
+        return True
 
     def check_color(self, color):
-        if color not in self.room.colors:
-            self.client.send(pickle.dumps(dict(data='',
-                                               msgtype='color_free')))
+        if not self.room.color_taken(color):
+            self.client.send_packet(dict(data='',
+                                         msgtype='color_free'))
         else:
             self.color = ''
-            self.client.send(pickle.dumps(dict(data='Цвет уже занят',
-                                               msgtype='color_not_free')))
+            self.client.send_packet(dict(data='Цвет уже занят',
+                                         msgtype='color_not_free'))
+
+class ClientHandler(PlayerSession, Thread):
+    def __init__(self, client_socket, rooms):
+        Thread.__init__(self)
+        PlayerSession.__init__(self, SocketConnection(client_socket), rooms)
+        self.socket = client_socket
+
+        self.start()
+
+    def run(self):
+        decoder = protocol.client_decoder()
+        try:
+            while True:
+                data_in_bytes = self.socket.recv(protocol.RECV_SIZE)
+
+                if not data_in_bytes:
+                    break
+
+                for data in decoder.feed(data_in_bytes):
+                    self.dispatch(data)
+
+        except (ConnectionError, OSError, protocol.FrameError):
+            print(f"Игрок {self.name} отключился.")
+        finally:
+            self.disconnect()
+            self.socket.close()
+
+class AsyncClientHandler(PlayerSession):
+    async def run(self, reader, pending=b''):
+        self.decoder = protocol.client_decoder()
+        try:
+            for data in self.decoder.feed(pending):
+                self.dispatch(data)
+
+            while True:
+                data_in_bytes = await reader.read(protocol.RECV_SIZE)
+
+                if not data_in_bytes:
+                    break
+
+                for data in self.decoder.feed(data_in_bytes):
+                    self.dispatch(data)
+
+        except (ConnectionError, OSError, protocol.FrameError):
+            print(f"Игрок {self.name} отключился.")
+        finally:
+            self.disconnect()
 
 def main():
-    game_server = GameServer('127.0.0.1', port=3435)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3435)
+    parser.add_argument('--mode', choices=('threaded', 'asyncio'), default='threaded')
+    parser.add_argument('--width', type=int, default=25)
+    parser.add_argument('--height', type=int, default=25)
+    parser.add_argument('--archive-dir')
+    parser.add_argument('--max-rooms', type=int, default=MAX_ROOMS)
+    parser.add_argument('--room-capacity', type=int, default=ROOM_CAPACITY)
+    ratelimit.add_arguments(parser)
+    parser.add_argument('--tick-ms', type=int, default=0,
+                        help='рассылать пиксели пачками раз в N мс, 0 - сразу')
+    parser.add_argument('--data-dir', help='каталог для журнала ходов и снимков холста')
+    parser.add_argument('--broker', help='HOST:PORT брокера для репликации комнат')
+    parser.add_argument('--node-id', type=int)
+    parser.add_argument('--metrics-host', default='127.0.0.1')
+    parser.add_argument('--metrics-port', type=int,
+                        help='порт HTTP для /metrics (Prometheus) и /metrics.json')
+    parser.add_argument('--metrics-json', help='файл для периодического JSON-дампа метрик')
+    parser.add_argument('--metrics-interval', type=float, default=metrics.DUMP_INTERVAL)
+    args = parser.parse_args()
+
+    if args.archive_dir:
+        os.makedirs(args.archive_dir, exist_ok=True)
+    if args.mode == 'asyncio':
+        game_server = AsyncGameServer(args.host, args.port, args.width, args.height,
+                                      args.archive_dir, args.max_rooms, args.room_capacity,
+                                      ratelimit.from_arguments(args),
+                                      args.tick_ms / 1000 or None, args.data_dir)
+    else:
+        game_server = GameServer(args.host, args.port, args.width, args.height,
+                                 args.archive_dir, args.max_rooms, args.room_capacity,
+                                 ratelimit.from_arguments(args),
+                                 args.tick_ms / 1000 or None, args.data_dir)
+    if args.broker:
+        host, port = args.broker.rsplit(':', 1)
+        game_server.replicator = replication.Replicator(
+            replication.BrokerBackend(host, int(port)), args.node_id)
+        for room in game_server.rooms:
+            game_server.replicator.attach(room)
+    if args.metrics_port:
+        metrics.serve(metrics.default, args.metrics_host, args.metrics_port)
+    if args.metrics_json:
+        metrics.dump_periodically(metrics.default, args.metrics_json, args.metrics_interval)
     game_server.start()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
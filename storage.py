@@ -0,0 +1,174 @@
+import mmap
+import os
+import struct
+import threading
+
+from canvas import from_wire
+
+RECORD = struct.Struct('!BIHHI')
+SNAPSHOT = struct.Struct('!4sHHI')
+SNAPSHOT_MAGIC = b'PXS1'
+PIXEL_RECORD = 0x01
+CLEAR_RECORD = 0x02
+COMMIT_INTERVAL = 0.05
+COMPACT_RECORDS = 100000
+
+
+def room_filename(name):
+    return name if name.isalnum() else name.encode().hex()
+
+
+class Storage:
+    def __init__(self, directory, commit_interval=COMMIT_INTERVAL):
+        self.directory = directory
+        self.commit_interval = commit_interval
+        self.dirty = set()
+        self.condition = threading.Condition()
+        os.makedirs(directory, exist_ok=True)
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def open(self, name, width, height):
+        return RoomStore(self, os.path.join(self.directory, room_filename(name)), width, height)
+
+    def mark(self, store):
+        with self.condition:
+            self.dirty.add(store)
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait(self.commit_interval)
+                stores, self.dirty = self.dirty, set()
+            for store in stores:
+                try:
+                    store.commit()
+                except OSError as error:
+                    print(f'Ошибка записи журнала {store.path}: {error}')
+
+
+class RoomStore:
+    def __init__(self, storage, path, width, height):
+        self.storage = storage
+        self.path = path
+        self.width = width
+        self.height = height
+        self.pending = []
+        self.records = 0
+        self.lock = threading.Lock()
+        self.commit_lock = threading.Lock()
+        self.log = None
+
+    @property
+    def log_path(self):
+        return self.path + '.log'
+
+    @property
+    def snapshot_path(self):
+        return self.path + '.snap'
+
+    def load(self, canvas):
+        version = self.load_snapshot(canvas)
+        version = self.replay_log(canvas, version)
+        self.log = open(self.log_path, 'ab')
+        return version
+
+    def load_snapshot(self, canvas):
+        try:
+            with open(self.snapshot_path, 'rb') as file, \
+                    mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                magic, width, height, version = SNAPSHOT.unpack_from(mapped)
+                size = width * height * 4
+                if (magic != SNAPSHOT_MAGIC or (width, height) != (self.width, self.height) or
+                        len(mapped) < SNAPSHOT.size + size):
+                    return 0
+                canvas.pixels[:] = from_wire(mapped[SNAPSHOT.size:SNAPSHOT.size + size])
+                return version
+        except (FileNotFoundError, ValueError, struct.error):
+            return 0
+
+    def replay_log(self, canvas, version):
+        try:
+            with open(self.log_path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return version
+        whole = len(data) - len(data) % RECORD.size
+        if whole != len(data):
+            with open(self.log_path, 'r+b') as file:
+                file.truncate(whole)
+        for kind, record_version, x, y, rgb in RECORD.iter_unpack(data[:whole]):
+            if kind == PIXEL_RECORD and record_version > version:
+                if canvas.contains(x, y):
+                    canvas.set(x, y, rgb)
+            elif kind == CLEAR_RECORD and record_version >= version:
+                canvas.clear()
+            else:
+                continue
+            version = record_version
+            self.records += 1
+        return version
+
+    def append_pixel(self, version, x, y, rgb):
+        self.append(RECORD.pack(PIXEL_RECORD, version, x, y, rgb))
+
+    def append_clear(self, version):
+        self.append(RECORD.pack(CLEAR_RECORD, version, 0, 0, 0))
+
+    def append(self, record):
+        with self.lock:
+            first = not self.pending
+            self.pending.append(record)
+            self.records += 1
+        if first:
+            self.storage.mark(self)
+
+    def needs_compaction(self):
+        return self.records >= COMPACT_RECORDS
+
+    def compact(self, version, canvas):
+        with self.lock:
+            self.pending.append((version, bytes(canvas.snapshot())))
+            self.records = 0
+        self.storage.mark(self)
+
+    def commit(self):
+        with self.commit_lock:
+            with self.lock:
+                items, self.pending = self.pending, []
+            if self.log is None:
+                return
+            records = []
+            for item in items:
+                if isinstance(item, bytes):
+                    records.append(item)
+                    continue
+                self.write_log(records)
+                records = []
+                self.write_snapshot(*item)
+                self.log.truncate(0)
+            self.write_log(records)
+
+    def write_log(self, records):
+        if records:
+            self.log.write(b''.join(records))
+            self.log.flush()
+            os.fsync(self.log.fileno())
+
+    def write_snapshot(self, version, pixels):
+        temporary = self.snapshot_path + '.tmp'
+        with open(temporary, 'w+b') as file:
+            file.truncate(SNAPSHOT.size + len(pixels))
+            with mmap.mmap(file.fileno(), 0) as mapped:
+                SNAPSHOT.pack_into(mapped, 0, SNAPSHOT_MAGIC, self.width, self.height, version)
+                mapped[SNAPSHOT.size:] = pixels
+                mapped.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.snapshot_path)
+
+    def close(self):
+        self.commit()
+        with self.commit_lock:
+            if self.log:
+                self.log.close()
+                self.log = None
@@ -0,0 +1,213 @@
+import argparse
+import pickle
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+import protocol
+import ratelimit
+from server import Connection, GameRoom, PlayerSession, RoomRegistry
+
+
+SAMPLE_PACKETS = (
+    dict(data='Игрок bob: привет', msgtype='chat'),
+    dict(data=dict(width=25, height=25), msgtype='room_info'),
+    dict(data=dict(ends_at=1700000000.5, remaining=42.25), msgtype='game_timer'),
+    dict(data=[f'Room{index}' for index in range(20)], msgtype='free_rooms'),
+    dict(data=('room:Room1', (7, 'pixel', (3, 4, 0xff0000, 123 << 16 | 7))), msgtype='publish'),
+)
+
+
+class FakeConnection(Connection):
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    def send(self, data):
+        self.frames += 1
+        self.bytes += len(data)
+
+    def close(self):
+        pass
+
+
+def make_registry(rooms, capacity, width, height):
+    limits = ratelimit.RateLimits(0, 0, 0, 0)
+    names = [f'Room{index}' for index in range(rooms)]
+    registry = RoomRegistry(lambda name: GameRoom(name, width, height, limits=limits),
+                            capacity=capacity, permanent=names)
+    return registry, names
+
+
+def check_room(registry, room):
+    errors = []
+    with room.lock:
+        clients = set(room.clients)
+        if len(clients) != len(room.clients):
+            errors.append('клиент в комнате дважды')
+        if len(room.clients) != len(room.clients_names):
+            errors.append('clients и clients_names разошлись')
+        if not set(room.colors) <= clients:
+            errors.append('цвет у игрока не из комнаты')
+        if not room.ready_clients <= clients:
+            errors.append('готовый игрок не из комнаты')
+        if len(room.clients) > registry.capacity:
+            errors.append('комната переполнена')
+        with registry.lock:
+            free = not room.is_active and registry.has_place(room)
+            if (room.name in registry.free) != free:
+                errors.append('индекс свободных комнат устарел')
+            if (room.name in registry.active) != room.is_active:
+                errors.append('индекс активных комнат устарел')
+    return [f'{room.name}: {error}' for error in errors]
+
+
+def player(registry, names, stop, stats, errors):
+    rng = random.Random()
+    counts = Counter()
+    session = PlayerSession(FakeConnection(), registry)
+    session.name = f'p{threading.get_ident()}'
+    try:
+        while not stop.is_set():
+            if session.room is None or session.client not in session.room.clients:
+                session.room = None
+                session.handle_packet(dict(data=rng.choice(names), msgtype='room'))
+                counts['joins'] += 1
+                continue
+            action = rng.random()
+            if action < 0.05:
+                session.disconnect()
+                session.room = None
+                counts['leaves'] += 1
+            elif action < 0.15:
+                session.color = f'#{rng.randrange(1 << 24):06x}'
+                session.handle_packet(dict(data=session.color, msgtype='color'))
+                if session.color:
+                    session.handle_packet(dict(data='', msgtype='new_player'))
+            elif action < 0.25:
+                session.handle_packet(dict(data='', msgtype='ready'))
+                counts['ready'] += 1
+            else:
+                width = session.room.game_state.width
+                height = session.room.game_state.height
+                session.handle_packet(dict(data=(rng.randrange(width), rng.randrange(height),
+                                                 rng.randrange(1 << 24)),
+                                           msgtype='game'))
+                counts['pixels'] += 1
+        if session.room:
+            session.disconnect()
+    except Exception as error:
+        errors.append(repr(error))
+    stats.append(counts)
+
+
+def stress(args):
+    registry, names = make_registry(args.rooms, args.capacity, args.width, args.height)
+    stop = threading.Event()
+    stats = []
+    errors = []
+    threads = [threading.Thread(target=player, args=(registry, names, stop, stats, errors))
+               for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+
+    deadline = time.monotonic() + args.seconds
+    while time.monotonic() < deadline and not errors:
+        for room in registry:
+            errors.extend(check_room(registry, room))
+        time.sleep(0.05)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    stats = sum(stats, Counter())
+    for room in registry:
+        errors.extend(check_room(registry, room))
+        if room.clients:
+            errors.append(f'{room.name}: после выхода всех игроков остались клиенты')
+
+    print(f"Стресс-тест: {stats['joins']} входов, {stats['leaves']} выходов, "
+          f"{stats['ready']} ready, {stats['pixels']} пикселей")
+    for error in errors[:20]:
+        print(f'Ошибка: {error}')
+    return not errors
+
+
+def bench(args):
+    room = GameRoom('Bench', args.width, args.height, limits=ratelimit.RateLimits(0, 0, 0, 0))
+    clients = [FakeConnection() for _ in range(args.clients)]
+    room.clients = list(clients)
+    room.clients_names = [f'p{index}' for index in range(args.clients)]
+    per_thread = args.pixels // args.threads
+
+    def write(seed):
+        rng = random.Random(seed)
+        for _ in range(per_thread):
+            room.place_pixel(dict(data=(rng.randrange(args.width), rng.randrange(args.height),
+                                        rng.randrange(1 << 24))))
+
+    threads = [threading.Thread(target=write, args=(seed,)) for seed in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    pixels = per_thread * args.threads
+    frames = sum(client.frames for client in clients)
+    print(f'Пропускная способность: {pixels / elapsed:.0f} пикселей/с, '
+          f'{frames / elapsed:.0f} кадров/с на {args.clients} клиентов '
+          f'({args.threads} потоков, {elapsed:.2f} с)')
+    return room.version == pixels
+
+
+def per_op(function, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+def codec_bench(args):
+    schema = protocol.CODECS[protocol.CODEC_VERSION]
+    header = protocol.HEADER
+    for packet in SAMPLE_PACKETS:
+        frame = protocol.encode(packet)
+        body = frame[header.size:]
+        pickled = pickle.dumps(packet)
+        results = (
+            per_op(lambda: protocol.encode(packet), args.iterations),
+            per_op(lambda: schema.decode(body), args.iterations),
+            per_op(lambda: header.pack(len(pickled)) + pickle.dumps(packet), args.iterations),
+            per_op(lambda: pickle.loads(pickled), args.iterations),
+        )
+        print(f"{packet['msgtype']:>12}: схема {results[0]:6.0f}/{results[1]:6.0f} нс, "
+              f"{len(frame):4} байт; pickle {results[2]:6.0f}/{results[3]:6.0f} нс, "
+              f"{header.size + len(pickled):4} байт")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=('stress', 'bench', 'codec'))
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--rooms', type=int, default=4)
+    parser.add_argument('--capacity', type=int, default=8)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--pixels', type=int, default=200000)
+    parser.add_argument('--width', type=int, default=25)
+    parser.add_argument('--height', type=int, default=25)
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    modes = dict(stress=stress, bench=bench, codec=codec_bench)
+    ok = modes[args.mode](args)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()